@@ -0,0 +1,350 @@
+"""
+bench.py
+========
+Benchmarks of the simulation hot paths: instruction decode, memory access,
+clocking a system, verilog_fmt and loading ELF/hex images. They only need
+the standard library and run offline, large images are generated in a
+temporary directory.
+
+Results are written as JSON so runs on different commits can be compared:
+
+    python -m pydigital.bench -o before.json
+    (change something)
+    python -m pydigital.bench -o after.json --compare before.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import struct
+import timeit
+import argparse
+import platform
+import tempfile
+import subprocess
+from .system import System
+from .register import Register
+from .memory import Memory, MemorySegment, ELFMemory, readmemh, writememh
+from .elfloader import Elf, load_elf
+from .utils import verilog_fmt
+from .riscv.isa import Instruction, BadInstruction, decode
+from .riscv import iss, translate
+
+_programs = os.path.join(os.path.dirname(__file__), "riscv", "programs")
+
+# generated images, removed at exit
+_tmp = None
+
+def _tempdir():
+    global _tmp
+    if _tmp is None:
+        _tmp = tempfile.TemporaryDirectory(prefix = "pydigital-bench-")
+    return tempfile.mkdtemp(dir = _tmp.name)
+
+# name: setup(scale) returning (run, ops), run() performs ops operations
+_benchmarks = {}
+
+def benchmark(name):
+    "decorator registering a benchmark setup function under name"
+    def register(setup):
+        _benchmarks[name] = setup
+        return setup
+    return register
+
+def _instruction_mix():
+    "the valid instruction words of dhrystone, a realistic instruction mix"
+    with Elf(os.path.join(_programs, "benchmarks", "dhrystone.riscv"), quiet = True) as e:
+        words = []
+        for _name, addr, offset, size in e.exec_sections():
+            e.f.seek(offset)
+            data = e.f.read(size)
+            for off in range(0, size - 3, 4):
+                words.append((addr + off, int.from_bytes(data[off:off+4], e.byteorder)))
+    mix = []
+    for pc, val in words:
+        try:
+            Instruction(val, pc)
+        except BadInstruction:
+            continue
+        mix.append((pc, val))
+    return mix
+
+@benchmark("isa.Instruction")
+def _bench_instruction(scale):
+    mix = _instruction_mix()
+    def run():
+        for pc, val in mix:
+            str(Instruction(val, pc))
+    return run, len(mix)
+
+@benchmark("isa.Instruction(text=False)")
+def _bench_instruction_notext(scale):
+    mix = _instruction_mix()
+    def run():
+        for pc, val in mix:
+            Instruction(val, pc, text = False)
+    return run, len(mix)
+
+@benchmark("isa.decode")
+def _bench_decode(scale):
+    vals = [val for _pc, val in _instruction_mix()]
+    def run():
+        for val in vals:
+            decode(val)
+    return run, len(vals)
+
+def _sim_bench(cls):
+    def setup(scale):
+        elffile = os.path.join(_programs, "benchmarks", "dhrystone.riscv")
+        n = 100000 * scale
+        def run():
+            sim = iss.load(elffile, cls)
+            sim.stdout = io.StringIO()
+            sim.run(n)
+        return run, n
+    return setup
+
+benchmark("riscv.iss[dhrystone]")(_sim_bench(iss.ISS))
+benchmark("riscv.translate[dhrystone]")(_sim_bench(translate.Translator))
+
+def _addresses(mem, n, size, seed = 0):
+    "n random aligned addresses inside the segments of mem"
+    r = random.Random(seed)
+    segs = getattr(mem, 'mems', [mem])
+    addrs = []
+    for _i in range(n):
+        seg = r.choice(segs)
+        addrs.append(seg.begin_addr + r.randrange(0, len(seg) - size + 1, size))
+    return addrs
+
+@benchmark("memory.out")
+def _bench_mem_out(scale):
+    mem = Memory(MemorySegment(begin_addr = 0x80000000, data = bytearray(2**20),
+        byteorder = 'little'))
+    addrs = _addresses(mem.mem, 10000 * scale, 4)
+    out = mem.out
+    def run():
+        for a in addrs:
+            out(a)
+    return run, len(addrs)
+
+@benchmark("memory.clock")
+def _bench_mem_clock(scale):
+    mem = Memory(MemorySegment(begin_addr = 0x80000000, data = bytearray(2**20),
+        byteorder = 'little'))
+    addrs = _addresses(mem.mem, 10000 * scale, 4)
+    clock = mem.clock
+    def run():
+        for a in addrs:
+            clock(a, a, 1)
+    return run, len(addrs)
+
+@benchmark("memory.ELFMemory[64 segments]")
+def _bench_elfmemory(scale):
+    sys_mem = ELFMemory()
+    for i in range(64):
+        sys_mem += MemorySegment(begin_addr = 0x10000 * i, data = bytearray(0x1000),
+            byteorder = 'little')
+    addrs = _addresses(sys_mem, 10000 * scale, 1)
+    def run():
+        for a in addrs:
+            sys_mem[a]
+    return run, len(addrs)
+
+@benchmark("memory.out[64 segments]")
+def _bench_elfmemory_out(scale):
+    sys_mem = ELFMemory()
+    for i in range(64):
+        sys_mem += MemorySegment(begin_addr = 0x10000 * i, data = bytearray(0x1000),
+            byteorder = 'little')
+    mem = Memory(sys_mem)
+    addrs = _addresses(sys_mem, 10000 * scale, 4)
+    out = mem.out
+    def run():
+        for a in addrs:
+            out(a)
+    return run, len(addrs)
+
+def _counters(n):
+    "a system of n chained registers, each adds one to the previous one"
+    regs = [Register() for _i in range(n)]
+    regs[0].inputs = [lambda r = regs[0]: (r.out() + 1) & 0xffffffff]
+    for prev, reg in zip(regs, regs[1:]):
+        reg.inputs = [lambda r = prev: (r.out() + 1) & 0xffffffff]
+    for reg in regs:
+        reg.reset(0)
+    return regs
+
+def _system_bench(n, monitor = False, headless = False):
+    def setup(scale):
+        regs = _counters(n)
+        s = System(posedge = regs, output = io.StringIO())
+        if monitor:
+            s.monitor("r0=%d r1=%d", regs[0].out, regs[-1].out)
+        ticks = 1000 * scale
+        def run():
+            s.output.seek(0)
+            s.output.truncate()
+            s.run(ticks, headless = headless)
+        return run, ticks
+    return setup
+
+for _n in (1, 32, 256):
+    benchmark(f"system.run[{_n} registers]")(_system_bench(_n))
+    benchmark(f"system.run[{_n} registers, headless]")(_system_bench(_n, headless = True))
+benchmark("system.run[32 registers, monitor]")(_system_bench(32, monitor = True))
+
+@benchmark("utils.verilog_fmt")
+def _bench_verilog_fmt(scale):
+    n = 10000 * scale
+    def run():
+        for i in range(n):
+            verilog_fmt("At time %3t, value = 0x%08x (%d)", i, i, timeval = i)
+    return run, n
+
+def make_elf(filename, size, symbols = 1024, seed = 0):
+    """
+    writes a little endian RV32 executable with one loadable .text segment
+    of size random bytes at 0x80000000 and a symbol table, for load tests
+    """
+    base, offset = 0x80000000, 0x1000
+    text = random.Random(seed).randbytes(size)
+    strtab = b"\0" + b"".join(f"f{i}\0".encode() for i in range(symbols))
+    symtab = [bytes(16)]
+    name = 1
+    for i in range(symbols):
+        # STB_GLOBAL STT_FUNC in section 1
+        symtab.append(struct.pack("<IIIBBH", name, base + i * (size // symbols), 0, 0x12, 0, 1))
+        name += len(f"f{i}") + 1
+    symtab = b"".join(symtab)
+    shstrtab = b"\0.text\0.symtab\0.strtab\0.shstrtab\0"
+    sym_off = offset + size
+    str_off = sym_off + len(symtab)
+    shstr_off = str_off + len(strtab)
+    sh_off = (shstr_off + len(shstrtab) + 3) & ~3
+    ident = b"\x7fELF\x01\x01\x01" + bytes(9)
+    header = ident + struct.pack("<HHIIIIIHHHHHH", 2, 243, 1, base, 52, sh_off,
+        0, 52, 32, 1, 40, 5, 4)
+    phdr = struct.pack("<IIIIIIII", 1, offset, base, base, size, size, 7, 0x1000)
+    shdrs = [bytes(40),
+        struct.pack("<IIIIIIIIII", 1, 1, 6, base, offset, size, 0, 0, 4, 0),
+        struct.pack("<IIIIIIIIII", 7, 2, 0, 0, sym_off, len(symtab), 3, 1, 4, 16),
+        struct.pack("<IIIIIIIIII", 15, 3, 0, 0, str_off, len(strtab), 0, 0, 1, 0),
+        struct.pack("<IIIIIIIIII", 23, 3, 0, 0, shstr_off, len(shstrtab), 0, 0, 1, 0)]
+    with open(filename, 'wb') as f:
+        f.write(header + phdr)
+        f.seek(offset)
+        f.write(text + symtab + strtab + shstrtab)
+        f.seek(sh_off)
+        f.write(b"".join(shdrs))
+
+def _load_bench(cached = False, **kwargs):
+    def setup(scale):
+        d = _tempdir()
+        elffile = os.path.join(d, "image.elf")
+        make_elf(elffile, 2**20 * scale)
+        if cached:
+            kwargs["cache"] = os.path.join(d, "cache")
+            load_elf(elffile, quiet = True, **kwargs)
+        def run():
+            load_elf(elffile, quiet = True, **kwargs)
+        return run, 1
+    return setup
+
+benchmark("elfloader.load_elf[1MB]")(_load_bench())
+benchmark("elfloader.load_elf[1MB, mapped]")(_load_bench(mapped = True))
+benchmark("elfloader.load_elf[1MB, paged]")(_load_bench(paged = True))
+benchmark("elfloader.load_elf[1MB, cached]")(_load_bench(cached = True))
+
+@benchmark("memory.readmemh[1MB]")
+def _bench_readmemh(scale):
+    hexfile = os.path.join(_tempdir(), "image.hex")
+    writememh(hexfile, MemorySegment(begin_addr = 0,
+        data = bytearray(random.Random(0).randbytes(2**20 * scale)), byteorder = 'little'))
+    def run():
+        readmemh(hexfile, byteorder = 'little')
+    return run, 1
+
+@benchmark("memory.writememh[1MB]")
+def _bench_writememh(scale):
+    hexfile = os.path.join(_tempdir(), "image.hex")
+    seg = MemorySegment(begin_addr = 0,
+        data = bytearray(random.Random(0).randbytes(2**20 * scale)), byteorder = 'little')
+    def run():
+        writememh(hexfile, seg)
+    return run, 1
+
+def measure(run, ops, repeat = 5):
+    """
+    times run() repeat times (each timing loops it for at least 0.2 s) and
+    returns the best time per run and operations per second
+    """
+    t = timeit.Timer(run)
+    number, _time = t.autorange()
+    best = min(t.repeat(repeat, number)) / number
+    return {"ops": ops, "seconds": best, "ops_per_sec": ops / best}
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+            cwd = os.path.dirname(__file__) or ".", capture_output = True,
+            text = True).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(select = None, scale = 1, repeat = 5, verbose = True):
+    """
+    runs the benchmarks whose name contains any of the select strings (all
+    when None) and returns the results as a JSON compatible dict
+    """
+    results = {}
+    for name, setup in _benchmarks.items():
+        if select and not any(s in name for s in select):
+            continue
+        results[name] = measure(*setup(scale), repeat = repeat)
+        if verbose:
+            r = results[name]
+            print(f"{name:45s} {r['ops_per_sec']:14,.0f} ops/s {r['seconds']*1e3:10.3f} ms")
+    return {
+        "commit": _commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "results": results,
+    }
+
+def compare(old, new, out = sys.stdout):
+    "prints the speedup of each benchmark in new relative to old"
+    out.write(f"{'benchmark':45s} {'old ops/s':>14s} {'new ops/s':>14s} {'speedup':>8s}\n")
+    for name, r in new["results"].items():
+        if name not in old["results"]:
+            continue
+        o = old["results"][name]["ops_per_sec"]
+        n = r["ops_per_sec"]
+        out.write(f"{name:45s} {o:14,.0f} {n:14,.0f} {n / o:7.2f}x\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks of the simulation hot paths.")
+    parser.add_argument("select", nargs = "*",
+        help = "only run benchmarks whose name contains one of these")
+    parser.add_argument("-o", "--output", help = "write the results to this JSON file")
+    parser.add_argument("--compare", help = "JSON results of an earlier run to compare with")
+    parser.add_argument("--scale", type = int, default = 1,
+        help = "multiplies the workload sizes")
+    parser.add_argument("--repeat", type = int, default = 5,
+        help = "timings per benchmark, the best is kept")
+    parser.add_argument("-l", "--list", action = "store_true", help = "list the benchmarks")
+    args = parser.parse_args()
+    if args.list:
+        print("\n".join(_benchmarks))
+        sys.exit()
+    results = run_benchmarks(args.select, args.scale, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -4,12 +4,60 @@ elfloader.py
 A wrapper for pyelftools https://github.com/eliben/pyelftools
 """
 
+import os
+import json
+import mmap
+import hashlib
+from bisect import bisect_right
 from elftools.elf.elffile import ELFFile
 from elftools.elf.enums import *
 from elftools.elf.sections import SymbolTableSection
 import elftools.elf.constants as elfconst
 
-from .memory import ELFMemory, MemorySegment
+from .memory import ELFMemory, MemorySegment, PagedMemory
+
+class SymbolIndex:
+    """
+    Symbol lookups: a sorted address array for nearest symbol (func+0x1c)
+    lookups with bisect and a separate name to address dict. Only symbols
+    of the given types are indexed. Indexing with an address (or in) matches
+    exact addresses, so the index can be used as the Instruction symbol table.
+    """
+    def __init__(self, entries = (), types = ('STT_FUNC', 'STT_OBJECT', 'STT_NOTYPE')):
+        "entries are (name, address, type) tuples"
+        self.by_name = {}
+        self._at = {} # address to name, the first name at an address wins
+        for name, addr, kind in entries:
+            if not name or kind not in types:
+                continue
+            self.by_name.setdefault(name, addr)
+            self._at.setdefault(addr, name)
+        self.addrs = sorted(self._at)
+        self.names = [self._at[a] for a in self.addrs]
+    def __len__(self):
+        return len(self.addrs)
+    def __contains__(self, addr):
+        return addr in self._at
+    def __getitem__(self, addr):
+        return self._at[addr]
+    def get(self, addr, default = None):
+        return self._at.get(addr, default)
+    def address(self, name):
+        "address of a symbol by name"
+        return self.by_name[name]
+    def lookup(self, addr):
+        "(name, offset) of the nearest symbol at or below addr, None if there is none"
+        i = bisect_right(self.addrs, addr) - 1
+        if i < 0:
+            return None
+        return self.names[i], addr - self.addrs[i]
+    def format(self, addr):
+        "addr as name+0x1c, or as hex if there is no symbol below it"
+        found = self.lookup(addr)
+        if found is None:
+            return f"{addr:08x}"
+        name, offset = found
+        return f"{name}+0x{offset:x}" if offset else name
 
 class Elf():
     """
@@ -37,9 +85,17 @@ class Elf():
             raise ValueError(f"Unsupported word size: {self.ef['e_ident']['EI_CLASS'] }")
 
         self.symtab = self.ef.get_section_by_name('.symtab')
-        # build a symbol lookup map forward and reverse
-        self.symbol_map = {sym.entry["st_value"]:sym.name for sym in self.symtab.iter_symbols()}
-        self.symbol_map.update({sym.name:sym.entry["st_value"] for sym in self.symtab.iter_symbols()})
+        # one pass over the symbols builds the index and the old combined
+        # symbol_map (address to name and name to address)
+        by_addr, by_name, entries = {}, {}, []
+        for sym in self.symtab.iter_symbols():
+            addr = sym.entry["st_value"]
+            by_addr[addr] = sym.name
+            by_name[sym.name] = addr
+            entries.append((sym.name, addr, sym.entry["st_info"]["type"]))
+        self.symbol_map = by_addr
+        self.symbol_map.update(by_name)
+        self.symbols = SymbolIndex(entries)
         
         return self
     def entry_point(self):
@@ -57,6 +113,12 @@ class Elf():
                     f'data = {len(d):4x}')
             yield segment["p_vaddr"], segment["p_memsz"], d
 
+    def segment_layout(self):
+        "like segments, but yields (vaddr, memsz, file offset, file size) without reading the data"
+        for segment in self.ef.iter_segments():
+            yield (segment["p_vaddr"], segment["p_memsz"],
+                segment["p_offset"], segment["p_filesz"])
+
     def sections(self):
         # print( '  --- SECTIONS ---')
         for idx, section in enumerate(self.ef.iter_sections()):
@@ -66,41 +128,166 @@ class Elf():
             #         hex(section["sh_size"]))
             yield section["sh_addr"], section["sh_size"], section.data()
             
+    def exec_sections(self):
+        "yields (name, addr, file offset, size) of the executable sections, without reading them"
+        for section in self.ef.iter_sections():
+            if section["sh_flags"] & elfconst.SH_FLAGS.SHF_EXECINSTR and \
+                section["sh_type"] != "SHT_NOBITS":
+                yield (section.name, section["sh_addr"], 
+                    section["sh_offset"], section["sh_size"])
+
     def __exit__(self, *args):
         self.f.close()
 
-def load_elf(elffile, stack_size = 64 * 2**10, quiet = False):
-    "this loads an elf file into memory segments for simulation"
-    # initialize memories as a unified memory (instruction + data)
-    sys_mem = ELFMemory()
-    # TODO this should read the word size from the file, now it assumes 32 bit.
-    with Elf(elffile, quiet=quiet) as e:
-        for addr, size, data in e.segments():
-            if len(data) == 0:
-                # non initalized segments need to be allocated
-                data = bytearray(size)
-            elif len(data) < size:
-                # bss segments are in size but not data
-                # need to zero initialize this memory.
-                data = bytearray(data) + bytearray(size-len(data))
-
-            ms = MemorySegment(
+def _zero_segment(addr, size, byteorder, paged):
+    "a zero initialized segment, PagedMemory only allocates it when written"
+    if paged:
+        return PagedMemory(begin_addr = addr, size = size, 
+            byteorder = byteorder, word_size = 4)
+    return MemorySegment(begin_addr = addr, data = bytearray(size), 
+        byteorder = byteorder, word_size = 4)
+
+def _map_segments(e, sys_mem, paged):
+    "adds the segments of an open Elf as views of a private (copy-on-write) mapping"
+    view = memoryview(mmap.mmap(e.f.fileno(), 0, access = mmap.ACCESS_COPY))
+    for addr, size, offset, filesize in e.segment_layout():
+        if filesize > 0:
+            sys_mem += MemorySegment(
                 begin_addr = addr,
-                data = data,
+                data = view[offset:offset + filesize],
                 byteorder = e.byteorder,
-                word_size = 4)
+                word_size = 4,
+                mapped = True)
+        if size > filesize or filesize == 0:
+            # only the bss tail is allocated
+            sys_mem += _zero_segment(addr + filesize, size - filesize, 
+                e.byteorder, paged)
+
+# prepared image cache file layout: magic, header length (8 bytes little 
+# endian), json header, then the segment images each aligned to a page
+_cache_magic = b"PDELF\x00\x01\x00"
+_cache_align = 4096
+
+def _page_align(n):
+    return -(-n // _cache_align) * _cache_align
+
+def _cache_key(elffile):
+    "cache key from the file path, size, mtime and a hash of the content"
+    st = os.stat(elffile)
+    h = hashlib.sha256()
+    with open(elffile, 'rb') as f:
+        h.update(f.read())
+    meta = f"{os.path.abspath(elffile)}\0{st.st_size}\0{st.st_mtime_ns}\0{h.hexdigest()}"
+    return hashlib.sha256(meta.encode()).hexdigest()
+
+def _read_cache(cache, key, paged):
+    """
+    loads a prepared image from the cache directory, returns the system 
+    memory (without stack) and symbol map, (None, None) on a miss. The image
+    is memory-mapped copy-on-write so only written pages are copied.
+    """
+    try:
+        with open(os.path.join(cache, key + ".img"), 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_COPY)
+    except (FileNotFoundError, ValueError):
+        return None, None
+    if mm[:8] != _cache_magic:
+        return None, None
+    n = int.from_bytes(mm[8:16], 'little')
+    header = json.loads(mm[16:16 + n])
+    # segment offsets are relative to the first page after the header
+    view = memoryview(mm)[_page_align(16 + n):]
+    sys_mem = ELFMemory()
+    for addr, size, offset in header["segments"]:
+        if paged:
+            sys_mem += PagedMemory(begin_addr = addr, data = view[offset:offset + size],
+                size = size, byteorder = header["byteorder"], word_size = 4)
+        else:
+            sys_mem += MemorySegment(begin_addr = addr, data = view[offset:offset + size], 
+                byteorder = header["byteorder"], word_size = 4, mapped = True)
+    return sys_mem, dict(header["symbols"])
+
+def _write_cache(cache, key, e, sys_mem):
+    "stores the prepared segment images, entry point, byteorder and symbols of an open Elf"
+    segments, offset = [], 0
+    for m in sys_mem.mems:
+        segments.append([m.begin_addr, len(m), offset])
+        offset += _page_align(len(m))
+    header = json.dumps({
+        "path": os.path.abspath(e.elffilename),
+        "entry": e.entry_point(),
+        "byteorder": e.byteorder,
+        "segments": segments,
+        "symbols": list(e.symbol_map.items()),
+    }).encode()
+    start = _page_align(16 + len(header))
+    os.makedirs(cache, exist_ok = True)
+    tmp = os.path.join(cache, f"{key}.{os.getpid()}.tmp")
+    with open(tmp, 'wb') as f:
+        f.write(_cache_magic + len(header).to_bytes(8, 'little') + header)
+        for (addr, size, offset), m in zip(segments, sys_mem.mems):
+            f.seek(start + offset)
+            f.write(m.read_block(addr, size))
+    os.replace(tmp, os.path.join(cache, key + ".img"))
+
+def load_elf(elffile, stack_size = 64 * 2**10, quiet = False, paged = False, 
+        mapped = False, cache = None):
+    """
+    this loads an elf file into memory segments for simulation
+    paged=True uses sparse PagedMemory segments, bss and the stack are then
+    only allocated as they are written.
+    mapped=True memory-maps the file copy-on-write, file backed segments are 
+    views of the private mapping so only the pages that are written get copied.
+    cache is an optional directory of prepared images (see _read_cache), 
+    a hit skips parsing the ELF file entirely.
+    """
+    sys_mem = None
+    if cache is not None:
+        key = _cache_key(elffile)
+        sys_mem, symbols = _read_cache(cache, key, paged)
+        if sys_mem is not None and not quiet:
+            print(f"Loaded ELF binary \"{elffile}\" from cache.")
+    if sys_mem is None:
+        # initialize memories as a unified memory (instruction + data)
+        sys_mem = ELFMemory()
+        # TODO this should read the word size from the file, now it assumes 32 bit.
+        with Elf(elffile, quiet=quiet) as e:
+            if mapped:
+                _map_segments(e, sys_mem, paged)
+            else:
+                for addr, size, data in e.segments():
+                    if paged:
+                        sys_mem += PagedMemory(
+                            begin_addr = addr,
+                            data = data,
+                            size = size,
+                            byteorder = e.byteorder,
+                            word_size = 4)
+                        continue
+                    if len(data) == 0:
+                        # non initalized segments need to be allocated
+                        data = bytearray(size)
+                    elif len(data) < size:
+                        # bss segments are in size but not data
+                        # need to zero initialize this memory.
+                        data = bytearray(data) + bytearray(size-len(data))
+
+                    ms = MemorySegment(
+                        begin_addr = addr,
+                        data = data,
+                        byteorder = e.byteorder,
+                        word_size = 4)
 
-            # add the segment to system memory
-            sys_mem += ms
+                    # add the segment to system memory
+                    sys_mem += ms
 
-        symbols = e.symbol_map    
+            symbols = e.symbol_map    
+            if cache is not None:
+                _write_cache(cache, key, e, sys_mem)
     # allocate stack immediately at the end of the elf segments
     # this is how the UCB linker script expects memory 
-    sys_mem += MemorySegment(
-        begin_addr = sys_mem.end_addr(),
-        count = stack_size,
-        byteorder = sys_mem.byteorder,
-        word_size = 4)
+    sys_mem += _zero_segment(sys_mem.end_addr(), 4 * stack_size, 
+        sys_mem.byteorder, paged)
     if not quiet:
         print(f"Created system memory in range {sys_mem.begin_addr():08x}:{sys_mem.end_addr():08x}")                
         print( "Segments:\n" + str(sys_mem))
@@ -3,7 +3,25 @@ memory.py
 =========
 Provides a byte-addressed memory.
 """
+import sys
+from array import array
+from bisect import bisect_right
+from struct import Struct
 from pydigital.utils import sextend
+# struct accessors precompiled for each (byteorder, byte_count, signed)
+_loads = {}
+_stores = {}
+for _order, _prefix in (('big', '>'), ('little', '<')):
+    for _n, _code in ((1, 'b'), (2, 'h'), (4, 'i'), (8, 'q')):
+        _loads[_order, _n, True] = Struct(_prefix + _code).unpack_from
+        _loads[_order, _n, False] = Struct(_prefix + _code.upper()).unpack_from
+        _stores[_order, _n] = Struct(_prefix + _code.upper()).pack_into
+    # 64-bit reads have always been unsigned
+    _loads[_order, 8, True] = _loads[_order, 8, False]
+# memory segment checkpoints are split into pages of 2**_page_shift bytes
+_page_shift = 12
+_masks = {1: 0xff, 2: 0xffff, 4: 0xffffffff, 8: 0xffffffffffffffff}
+
 class Memory:
     "Memory module which implements the risc-v sodor memory interface"
     def __init__(self, segment = None):
@@ -13,56 +31,251 @@ class Memory:
         "read access"
         if addr == None:
             return None
-        #TODO check of byte_count is larger than word size, that won't work!
-        if signed:
-            f = sextend
-        else:
-            f = lambda x, c: x
-        if byte_count == 1:
-            return f(self.mem[addr] & 0xff, 8)
-        elif byte_count == 2:
-            return f(self.mem[addr] & 0xffff, 16)
-        elif byte_count == 4:
-            return f(self.mem[addr] & 0xffffffff, 32)
-        elif byte_count == 8:
-            return self.mem[addr] & 0xffffffffffffffff
-        else:
+        try:
+            unpack = _loads[self.mem.byteorder, byte_count, signed]
+        except KeyError:
             raise ValueError("Mem can only access Bytes/Half Words/Words.")
+        try:
+            loc = self.mem.locate(addr, byte_count)
+        except AttributeError:
+            # segments that only have the item interface
+            loc = None
+        if loc is None:
+            # not inside a single buffer (eg. the end of a segment)
+            return self._out(addr, byte_count, signed)
+        return unpack(*loc)[0]
+    def _out(self, addr, byte_count, signed):
+        "read access for blocks that are not inside a single buffer"
+        try:
+            val = int.from_bytes(_read_block(self.mem, addr, byte_count), 
+                byteorder = self.mem.byteorder, signed = False)
+        except IndexError:
+            # a partial word at the end of memory
+            val = self.mem[addr] & _masks[byte_count]
+        if signed and byte_count < 8:
+            return sextend(val, byte_count * 8)
+        return val
     def clock(self, addr, data, mem_rw = 0, byte_count = 4):
         "synchronous write, mem_rw=1 for write"
         if mem_rw == 1:
-            mask = (2**(byte_count*8))-1
-            #print(f"MEM write mask {mask:08x} masked val is {(mask&data):08x} of {byte_count} bytes")
-            # mask out any upper bits so to_bytes doesn't complain
-            val = (mask & data).to_bytes(length=byte_count,
-                byteorder = self.mem.byteorder, signed = False)
-            #print(f'MEM val is {val}')
-            self.mem[addr] = val
-class ELFMemory:
+            # mask out any upper bits so the value is stored unsigned
+            mask = _masks[byte_count]
+            try:
+                loc = self.mem.locate(addr, byte_count, True)
+            except AttributeError:
+                loc = None
+            if loc is None:
+                # not inside a single buffer, it may span adjacent segments
+                val = (mask & data).to_bytes(length=byte_count,
+                    byteorder = self.mem.byteorder, signed = False)
+                if hasattr(self.mem, 'write_block'):
+                    self.mem.write_block(addr, val)
+                else:
+                    self.mem[addr] = val
+            else:
+                _stores[self.mem.byteorder, byte_count](*loc, mask & data)
+    def checkpoint(self):
+        "snapshot of the memory contents"
+        return self.mem.checkpoint()
+    def restore(self, state):
+        "restore the memory contents from a checkpoint() snapshot"
+        self.mem.restore(state)
+
+def _read_block(m, addr, n):
+    """
+    read_block of a segment, segments that only have the item interface 
+    (eg. device registers) are read a byte at a time
+    """
+    read = getattr(m, 'read_block', None)
+    if read is not None:
+        return read(addr, n)
+    if addr not in m or addr + n - 1 not in m:
+        raise IndexError(f"Block {addr:08x}:{addr+n:08x} is not inside {m}.")
+    # an item is the word starting at the address, keep its first byte
+    ws = getattr(m, 'word_size', 4)
+    mask = (1 << 8 * ws) - 1
+    return bytes((m[a] & mask).to_bytes(ws, m.byteorder)[0] for a in range(addr, addr + n))
+
+# array typecodes for unsigned words of each size in bytes
+_typecodes = {array(t).itemsize: t for t in 'QLIHB'}
+
+def _to_words(data, word_size, byteorder):
+    "decode bytes into an array of unsigned words"
+    a = array(_typecodes[word_size])
+    a.frombytes(data)
+    if byteorder != sys.byteorder and word_size > 1:
+        a.byteswap()
+    return a
+
+def _from_words(words, word_size, byteorder):
+    "encode a sequence of unsigned words as bytes"
+    a = array(_typecodes[word_size], words)
+    if byteorder != sys.byteorder and word_size > 1:
+        a.byteswap()
+    return a.tobytes()
+
+class _Words:
+    "word access of the memories, built on read_block and write_block"
+    def read_words(self, addr, count, word_size = None):
+        "decode count unsigned words (of word_size bytes) starting at addr into an array"
+        word_size = word_size or self.word_size
+        return _to_words(self.read_block(addr, count * word_size),
+            word_size, self.byteorder)
+    def write_words(self, addr, words, word_size = None):
+        "encode a sequence of unsigned words and write them starting at addr"
+        word_size = word_size or self.word_size
+        self.write_block(addr, _from_words(words, word_size, self.byteorder))
+
+class _Segment(_Words):
+    "the item interface shared by the contiguous segments"
+    def __setitem__(self, i, val, signed=False):
+        "set a word at given *byte* address"
+        if type(val) == int:
+            # convert to a words/bytes
+            val = val.to_bytes(length=self.word_size, 
+                byteorder=self.byteorder, signed=signed)
+        if type(val) == bytes or type(val) == bytearray or type(val) == memoryview:
+            self.write_block(i, val)
+        else:
+            raise ValueError("Value must be bytes or int.")
+        # self.data[(i - self.begin_addr) // self.word_size] = self.fromTwosComp(val)
+    def __contains__(self, addr):
+        "is the given byte address in this memory segment?"
+        if isinstance(addr, slice):
+            return addr.start in self and addr.stop in self
+        else:
+            return addr >= self.begin_addr and addr < self.end_addr
+
+class ELFMemory(_Words):
     "ELFMemory is a collection of memory segments that supports get/set"
     def __init__(self):        
         self.mems = []
         self.byteorder = None
+        self.word_size = 4 # read_words default, that of the first segment
+        # address index of non overlapping ranges sorted for bisect, where
+        # segments overlap the range belongs to the segment added first
+        self._begins = []
+        self._ends = []
+        self._segs = []
+        self._last = None # last range hit (begin, end, segment), most accesses hit it again
+    def _range(self, i):
+        "the indexed (begin, end, segment) range holding byte address i, None if not mapped"
+        r = self._last
+        if r is not None and r[0] <= i < r[1]:
+            return r
+        k = bisect_right(self._begins, i) - 1
+        if k >= 0 and i < self._ends[k]:
+            r = self._last = (self._begins[k], self._ends[k], self._segs[k])
+            return r
+        return None
+    def find(self, i):
+        "return the segment holding byte address i, None if not mapped"
+        r = self._range(i)
+        return None if r is None else r[2]
+    def __contains__(self, i):
+        return self.find(i) is not None
     def __getitem__(self, i):
         if i == None: 
             return None
-        for m in self.mems:
-            if i in m:
+        if isinstance(i, slice):
+            for m in self.mems:
+                if i in m:
+                    return m[i]
+        else:
+            m = self.find(i)
+            if m is not None:
                 return m[i]
         raise IndexError(f"Address {i:08x} not found in memory.")
     def __setitem__(self, i, val):
         if i == None:
             return
-        for m in self.mems:
-            if i in m:                  
-                m[i] = val
+        r = self._range(i)
+        if r is None:
+            return
+        if isinstance(val, (bytes, bytearray, memoryview)) and i + len(val) > r[1]:
+            # the bytes continue into the following segments
+            self.write_block(i, val)
+        else:
+            r[2][i] = val
     def __iadd__(self, seg):
         if self.byteorder == None:
             self.byteorder = seg.byteorder      
+            self.word_size = getattr(seg, 'word_size', 4)
         elif self.byteorder != seg.byteorder:
             raise ValueError("Byteorder does not match previous segments.")
         self.mems.append(seg)
+        # index the parts of seg that earlier segments do not cover
+        begins, ends = self._begins, self._ends
+        b, e = seg.begin_addr, seg.end_addr
+        k = bisect_right(begins, b) - 1
+        if k >= 0:
+            b = max(b, ends[k])
+        k += 1
+        while b < e:
+            if k < len(begins) and begins[k] <= b:
+                b = max(b, ends[k])
+            else:
+                end = min(e, begins[k]) if k < len(begins) else e
+                begins.insert(k, b)
+                ends.insert(k, end)
+                self._segs.insert(k, seg)
+                b = end
+            k += 1
+        self._last = None
         return self
+    def locate(self, addr, n, write = False):
+        "(buffer, offset) of n bytes at addr for struct access, None if not inside one segment"
+        r = self._range(addr)
+        if r is None or addr + n > r[1]:
+            return None
+        try:
+            return r[2].locate(addr, n, write)
+        except AttributeError:
+            # a segment with only the item interface
+            return None
+    def read_block(self, addr, n):
+        """
+        view of n bytes starting at addr, zero-copy when the block is inside
+        one segment, blocks spanning adjacent segments are gathered into a copy
+        """
+        r = self._range(addr)
+        if r is None:
+            raise IndexError(f"Address {addr:08x} not found in memory.")
+        if addr + n <= r[1]:
+            return _read_block(r[2], addr, n)
+        buf = bytearray()
+        for m, a, k in self._blocks(addr, n):
+            buf += _read_block(m, a, k)
+        return memoryview(buf)
+    def write_block(self, addr, buf):
+        "write a bytes-like buf starting at addr, it may span adjacent segments"
+        buf = memoryview(buf).cast('B')
+        pos = 0
+        for m, a, k in self._blocks(addr, len(buf)):
+            if hasattr(m, 'write_block'):
+                m.write_block(a, buf[pos:pos+k])
+            else:
+                m[a] = bytes(buf[pos:pos+k])
+            pos += k
+    def _blocks(self, addr, n):
+        "split addr:addr+n into (segment, addr, count) pieces"
+        end = addr + n
+        while addr < end:
+            r = self._range(addr)
+            if r is None:
+                raise IndexError(f"Address {addr:08x} not found in memory.")
+            k = min(end, r[1]) - addr
+            yield r[2], addr, k
+            addr += k
+    def checkpoint(self):
+        "snapshot of every segment, see MemorySegment.checkpoint"
+        return tuple(m.checkpoint() for m in self.mems)
+    def restore(self, state):
+        "restore the segments from a checkpoint() snapshot"
+        if len(state) != len(self.mems):
+            raise ValueError("Checkpoint does not match the memory segments.")
+        for m, s in zip(self.mems, state):
+            m.restore(s)
     def begin_addr(self):
         "return the lowest begin address included"
         return min([m.begin_addr for m in self.mems])
@@ -73,15 +286,18 @@ class ELFMemory:
         "debug segment addresses"
         s = []
         for i, seg in enumerate(self.mems):
-            s += [f"[{i}] {seg.begin_addr:08x}:{seg.end_addr:08x} ({len(seg.data):4x} bytes)"]
+            s += [f"[{i}] {seg.begin_addr:08x}:{seg.end_addr:08x} ({len(seg):4x} bytes)"]
         return "\n".join(s)
     def __len__(self):
-        return sum([len(m.data) for m in self.mems])
-class MemorySegment:
+        return sum([len(m) for m in self.mems])
+class MemorySegment(_Segment):
     "A continuous segment of byte addressable memory"
     def __init__(self, begin_addr = 0x1000, count = None, 
-        word_size = 4, data = None, byteorder = 'big'):
-        "create a new memory from begin_addr with count words (32 or 64 bits per word)"
+        word_size = 4, data = None, byteorder = 'big', mapped = False):
+        """
+        create a new memory from begin_addr with count words (32 or 64 bits per word),
+        mapped=True uses the writable buffer data in place (eg. a private file mapping)
+        """
         self.word_size = word_size
         self.byteorder = byteorder
         if data == None:
@@ -91,13 +307,19 @@ class MemorySegment:
         else:
             if count != None:
                  raise ValueError("Count must NOT be given with data.")            
-            if type(data) is bytearray:
+            if mapped:
+                self.data = memoryview(data).cast('B')
+            elif type(data) is bytearray:
                 self.data = data
             else:
                 # attempt to convert to bytearray
                 self.data = bytearray(data)
         self.end_addr = begin_addr + len(self.data)
         self.begin_addr = begin_addr
+        # dirty page tracking, pages written since the last checkpoint 
+        # (the base snapshot), off until the first checkpoint is taken
+        self._base = None
+        self._dirty = None
     def __str__(self):
         return f"Memory[{self.begin_addr:8x}:{self.end_addr:8x}] ({len(self.data)})"
     def __getitem__(self, i):
@@ -121,62 +343,352 @@ class MemorySegment:
             return int.from_bytes(
                 self.data[i: i+self.word_size],
                 byteorder=self.byteorder, signed=False)
-    def __setitem__(self, i, val, signed=False):
-        "set a word at given *byte* address"
-        if type(val) == int:
-            # convert to a words/bytes
-            val = val.to_bytes(length=self.word_size, 
-                byteorder=self.byteorder, signed=signed)
-        if type(val) == bytes or type(val) == bytearray:
-            # print('setting bytes', val)
-            # byte by byte copy
-            i -= self.begin_addr
-            for v in val:
-                self.data[i] = v
-                i += 1 
-        else:
-            raise ValueError("Value must be bytes or int.")
-        # self.data[(i - self.begin_addr) // self.word_size] = self.fromTwosComp(val)
-    def __contains__(self, addr):
-        "is the given byte address in this memory segment?"
-        if isinstance(addr, slice):
-            return addr.start in self and addr.stop in self
+    def __len__(self):
+        return len(self.data)
+    def locate(self, addr, n, write = False):
+        "(buffer, offset) of n bytes at addr for struct access, None if they are not all here"
+        i = addr - self.begin_addr
+        if 0 <= i and i + n <= len(self.data):
+            if write and self._dirty is not None:
+                self._mark(i, n)
+            return self.data, i
+        return None
+    def _mark(self, i, n):
+        "mark the pages of n bytes at offset i as written since the last checkpoint"
+        self._dirty.update(range(i >> _page_shift, ((i + n - 1) >> _page_shift) + 1))
+    def _offset(self, addr, n):
+        "offset of addr in data, checking that n bytes fit in this segment"
+        i = addr - self.begin_addr
+        if i < 0 or i + n > len(self.data):
+            raise IndexError(f"Block {addr:08x}:{addr+n:08x} is not inside {self}.")
+        return i
+    def read_block(self, addr, n):
+        "zero-copy view of n bytes starting at byte address addr"
+        i = self._offset(addr, n)
+        return memoryview(self.data)[i:i+n]
+    def write_block(self, addr, buf):
+        "copy a bytes-like buf into memory starting at byte address addr"
+        i = self._offset(addr, len(buf))
+        self.data[i:i+len(buf)] = buf
+        if self._dirty is not None:
+            self._mark(i, len(buf))
+    def checkpoint(self):
+        """
+        snapshot of the contents as a tuple of immutable pages. Writes are 
+        tracked from the first checkpoint on, pages that were not written 
+        since the last checkpoint or restore are shared with it, so taking 
+        a snapshot only copies the dirty pages.
+        """
+        data, size = self.data, 1 << _page_shift
+        if self._base is None:
+            pages = tuple(bytes(data[i:i+size]) for i in range(0, len(data), size))
         else:
-            return addr >= self.begin_addr and addr < self.end_addr
+            pages = list(self._base)
+            for p in self._dirty:
+                pages[p] = bytes(data[p*size:(p+1)*size])
+            pages = tuple(pages)
+        self._base = pages
+        self._dirty = set()
+        return pages
+    def restore(self, pages):
+        "restore the contents from a checkpoint() snapshot, only changed pages are copied"
+        data, size = self.data, 1 << _page_shift
+        if sum(len(page) for page in pages) != len(data):
+            raise ValueError(f"Checkpoint does not match the size of {self}.")
+        base, dirty = self._base, self._dirty or ()
+        for p, page in enumerate(pages):
+            if base is None or page is not base[p] or p in dirty:
+                data[p*size:p*size+len(page)] = page
+        self._base = pages
+        self._dirty = set()
     def to_hex(self):
-        s = ["@" + format(int(self.begin_addr / self.word_size), "x")]
-        
-        fmt = f"0{2*self.word_size}x"
-        num = int(len(self.data) / self.word_size)
-        print(fmt)
-        for wordaddr in range(num):
-            byteaddr = wordaddr * self.word_size
-            d = int.from_bytes(self.data[byteaddr: byteaddr + self.word_size], 
-                byteorder=self.byteorder)    
-            s.append(format(d, fmt))
-
-        return " ".join(s)
+        "the segment as verilog hex text, @address followed by the words"
+        return "".join(_mem_text(self, 16, " "))
 
-def readmemh(filename, begin_addr = 0, word_size = 4, byteorder = 'big'):
-    "reads a verilog hex file and returns a memory segment"
-    at = begin_addr
-    data = None
-    with open (filename, 'r') as f:
-        for statement in f.read().split():            
-            if statement[0] == '@':
-                if data != None:
-                    # output segment before creating a new one
-                    # multi segment hex files are not supported atm.
-                    raise NotImplementedError()
-                # the hex file is indexed by words
-                at = word_size * int (statement[1:], base=16)
-                data = []
+class PagedMemory(_Segment):
+    """
+    A sparse segment of byte addressable memory. Pages are allocated on 
+    first write and untouched pages read as zero, so large bss regions and 
+    stacks only cost the memory that is actually used.
+    """
+    def __init__(self, begin_addr = 0x1000, count = None, 
+        word_size = 4, data = None, byteorder = 'big', size = None, page_size = 4096):
+        """
+        create a new memory from begin_addr with count words, or size bytes,
+        optionally initialized from data (which may be shorter than size)
+        """
+        if page_size & (page_size - 1):
+            raise ValueError("Page size must be a power of two.")
+        if size == None:
+            if count != None:
+                size = word_size * count
+            elif data != None:
+                size = len(data)
+            else:
+                raise ValueError("Count, size or data must be given.")
+        self.word_size = word_size
+        self.byteorder = byteorder
+        self.page_size = page_size
+        self._shift = page_size.bit_length() - 1
+        self._zero = bytes(page_size)
+        self.pages = {}
+        self.begin_addr = begin_addr
+        self.end_addr = begin_addr + size
+        # dirty page tracking like MemorySegment
+        self._base = None
+        self._dirty = None
+        if data != None:
+            # only pages holding non zero data are allocated
+            for i in range(0, len(data), page_size):
+                chunk = data[i:i+page_size]
+                if chunk != self._zero[:len(chunk)]:
+                    self.write_block(begin_addr + i, chunk)
+    def __str__(self):
+        return f"PagedMemory[{self.begin_addr:8x}:{self.end_addr:8x}] ({len(self)}, {self.allocated()} allocated)"
+    def __len__(self):
+        return self.end_addr - self.begin_addr
+    def allocated(self):
+        "number of bytes in allocated pages"
+        return len(self.pages) * self.page_size
+    def _page(self, p):
+        "return page p, allocating it"
+        page = self.pages.get(p)
+        if page is None:
+            page = self.pages[p] = bytearray(self.page_size)
+        if self._dirty is not None:
+            self._dirty.add(p)
+        return page
+    def locate(self, addr, n, write = False):
+        "(buffer, offset) of n bytes at addr for struct access, None if they are not in one page"
+        i = addr - self.begin_addr
+        if i < 0 or addr + n > self.end_addr:
+            return None
+        p, off = i >> self._shift, i & (self.page_size - 1)
+        if off + n > self.page_size:
+            return None
+        if write:
+            return self._page(p), off
+        return self.pages.get(p, self._zero), off
+    def _check(self, addr, n):
+        if addr < self.begin_addr or addr + n > self.end_addr:
+            raise IndexError(f"Block {addr:08x}:{addr+n:08x} is not inside {self}.")
+    def read_block(self, addr, n):
+        "view of n bytes starting at addr, zero-copy when the block is inside one page"
+        loc = self.locate(addr, n)
+        if loc is not None:
+            buf, off = loc
+            return memoryview(buf)[off:off+n]
+        self._check(addr, n)
+        buf = bytearray(n)
+        pos = 0
+        while pos < n:
+            i = addr + pos - self.begin_addr
+            p, off = i >> self._shift, i & (self.page_size - 1)
+            k = min(n - pos, self.page_size - off)
+            if p in self.pages:
+                buf[pos:pos+k] = self.pages[p][off:off+k]
+            pos += k
+        return memoryview(buf)
+    def write_block(self, addr, buf):
+        "copy a bytes-like buf into memory starting at addr, allocating pages"
+        n = len(buf)
+        self._check(addr, n)
+        pos = 0
+        while pos < n:
+            i = addr + pos - self.begin_addr
+            p, off = i >> self._shift, i & (self.page_size - 1)
+            k = min(n - pos, self.page_size - off)
+            self._page(p)[off:off+k] = buf[pos:pos+k]
+            pos += k
+    def checkpoint(self):
+        "snapshot of the allocated pages as a dict of immutable pages, see MemorySegment.checkpoint"
+        if self._base is None:
+            pages = {p: bytes(page) for p, page in self.pages.items()}
+        else:
+            pages = dict(self._base)
+            for p in self._dirty:
+                pages[p] = bytes(self.pages[p])
+        self._base = pages
+        self._dirty = set()
+        return pages
+    def restore(self, pages):
+        "restore the pages from a checkpoint() snapshot, only changed pages are copied"
+        base, dirty = self._base, self._dirty or ()
+        for p in [p for p in self.pages if p not in pages]:
+            del self.pages[p]
+        for p, page in pages.items():
+            if base is None or page is not base.get(p) or p in dirty:
+                self.pages[p] = bytearray(page)
+        self._base = pages
+        self._dirty = set()
+    def __getitem__(self, i):
+        "get a word from a given *byte* address"
+        if i == None:
+            return None
+        if isinstance(i, slice):
+            # if you ask for a slice, you get raw bytes
+            return bytearray(self.read_block(i.start, i.stop - i.start)[::i.step])
+        # words at the end of the memory are truncated, like MemorySegment
+        n = min(self.word_size, self.end_addr - i)
+        return int.from_bytes(self.read_block(i, n),
+            byteorder=self.byteorder, signed=False)
+
+def _byteswap(data, word_size):
+    "reverses the byte order of every word in data"
+    if word_size in _typecodes:
+        a = array(_typecodes[word_size])
+        a.frombytes(data)
+        a.byteswap()
+        return a.tobytes()
+    return b"".join(data[i:i+word_size][::-1] for i in range(0, len(data), word_size))
+
+def _parse_words(tokens, base, word_size, byteorder):
+    "converts a run of hex or binary word tokens to bytes in one go"
+    if not tokens:
+        return b""
+    digits = 2 * word_size if base == 16 else 8 * word_size
+    widths = set(map(len, tokens))
+    if max(widths) > digits:
+        raise ValueError(f"Word wider than {word_size} bytes in memory file.")
+    if len(widths) > 1 or digits not in widths:
+        # short words are zero extended like $readmemh does
+        tokens = [t.zfill(digits) for t in tokens]
+    s = "".join(tokens)
+    if base == 16:
+        data = bytes.fromhex(s)
+    else:
+        data = int(s, 2).to_bytes(len(s) // 8, 'big')
+    if byteorder != 'big' and word_size > 1:
+        data = _byteswap(data, word_size)
+    return data
+
+def _readmem(filename, base, begin_addr, word_size, byteorder, block_size = 2**20):
+    """
+    streams a verilog memory file in blocks of whole words, the words of a
+    block are converted in bulk. Every @address that does not continue the
+    current segment starts a new one, words written again by a later
+    @address overwrite the earlier ones.
+    """
+    segments = []
+    at, data = begin_addr, bytearray()
+    carry = ""
+    with open(filename, 'r') as f:
+        while True:
+            block = f.read(block_size)
+            text = carry + block
+            if block:
+                cut = text.rfind('\n') + 1
+                if '//' not in text[cut:]:
+                    # long lines (eg. writememh output) are cut between words
+                    cut = max(cut, text.rfind(' ') + 1, text.rfind('\t') + 1)
+                text, carry = text[:cut], text[cut:]
+            if '//' in text:
+                text = "\n".join(line.split('//')[0] for line in text.split('\n'))
+            if '_' in text:
+                text = text.replace('_', '')
+            if '@' not in text:
+                data += _parse_words(text.split(), base, word_size, byteorder)
             else:
-                data.append(int(statement, 16).to_bytes(word_size, byteorder))
-
-    data = b"".join(data)
-    return MemorySegment(begin_addr = at, 
-        data = data, 
-        word_size = word_size,
-        byteorder = byteorder)
-    
\ No newline at end of file
+                run = []
+                for token in text.split():
+                    if token[0] != '@':
+                        run.append(token)
+                        continue
+                    data += _parse_words(run, base, word_size, byteorder)
+                    run = []
+                    # the memory file is indexed by words
+                    addr = word_size * int(token[1:], 16)
+                    if addr != at + len(data):
+                        if data:
+                            segments.append((at, data))
+                        at, data = addr, bytearray()
+                data += _parse_words(run, base, word_size, byteorder)
+            if not block:
+                break
+    if data or not segments:
+        segments.append((at, data))
+    return _segments(_merge(segments), word_size, byteorder)
+
+def _merge(segments):
+    """
+    merges overlapping or adjacent (address, data) segments given in file
+    order, later data wins where they overlap, returns them sorted by address
+    """
+    merged = []
+    group, end = [], None
+    for k, (at, data) in sorted(enumerate(segments), key = lambda s: s[1][0]):
+        if group and at > end:
+            merged.append(_overlay(group))
+            group = []
+        group.append((k, at, data))
+        end = max(end, at + len(data)) if len(group) > 1 else at + len(data)
+    if group:
+        merged.append(_overlay(group))
+    return merged
+
+def _overlay(group):
+    "one (address, data) segment from a group of (order, address, data)"
+    if len(group) == 1:
+        return group[0][1:]
+    begin = min(at for _k, at, _data in group)
+    data = bytearray(max(at + len(d) for _k, at, d in group) - begin)
+    for _k, at, d in sorted(group):
+        data[at - begin:at - begin + len(d)] = d
+    return begin, data
+
+def _segments(segments, word_size, byteorder):
+    "a memory segment, or an ELFMemory when there are several"
+    mems = [MemorySegment(begin_addr = at, data = data, word_size = word_size, 
+        byteorder = byteorder) for at, data in segments]
+    if len(mems) == 1:
+        return mems[0]
+    sys_mem = ELFMemory()
+    for m in mems:
+        sys_mem += m
+    return sys_mem
+
+def readmemh(filename, begin_addr = 0, word_size = 4, byteorder = 'big'):
+    """
+    reads a verilog hex file and returns a memory segment, or an ELFMemory
+    when the file has several @address segments
+    """
+    return _readmem(filename, 16, begin_addr, word_size, byteorder)
+
+def readmemb(filename, begin_addr = 0, word_size = 4, byteorder = 'big'):
+    "reads a verilog binary file, like readmemh"
+    return _readmem(filename, 2, begin_addr, word_size, byteorder)
+
+def _mem_text(seg, base, sep, chunk_words = 2**14):
+    "yields the verilog memory text of a segment in chunks"
+    ws = seg.word_size
+    yield "@" + format(seg.begin_addr // ws, "x")
+    # a trailing partial word is not written
+    size = len(seg) - len(seg) % ws
+    chunk = chunk_words * ws
+    for i in range(0, size, chunk):
+        block = bytes(seg.read_block(seg.begin_addr + i, min(chunk, size - i)))
+        if seg.byteorder != 'big' and ws > 1:
+            block = _byteswap(block, ws)
+        if base == 16:
+            yield sep + block.hex(sep, ws)
+        else:
+            bits = format(int.from_bytes(block, 'big'), f"0{8*len(block)}b")
+            yield sep + sep.join(bits[j:j+8*ws] for j in range(0, len(bits), 8*ws))
+
+def _writemem(filename, mem, base):
+    with open(filename, 'w') as f:
+        for seg in getattr(mem, 'mems', [mem]):
+            for s in _mem_text(seg, base, "\n"):
+                f.write(s)
+            f.write("\n")
+
+def writememh(filename, mem):
+    """
+    writes a memory segment, PagedMemory or ELFMemory to a verilog hex file
+    that readmemh reads back, one word per line
+    """
+    _writemem(filename, mem, 16)
+
+def writememb(filename, mem):
+    "writes a memory to a verilog binary file, like writememh"
+    _writemem(filename, mem, 2)
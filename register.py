@@ -1,7 +1,7 @@
 """
 register.py
 ===========
-A simple clocked register.
+A simple clocked register and a bank of registers (register file).
 """
 class Register:
     """
@@ -20,4 +20,61 @@ class Register:
     def clock (self, next_val):
         # the system should evaluate all inputs and pass in the next value here
         # we just need to assign (copy) them to the stored values
-        self._val = next_val
\ No newline at end of file
+        self._val = next_val
+    def checkpoint(self):
+        # the state saved by System.checkpoint
+        return self._val
+    def restore(self, state):
+        self._val = state
+class RegisterBank:
+    """
+    N registers stored in one list, eg. a register file. Reads are indexed,
+    write requests are collected during an edge and committed together by 
+    one clock() call, so clocking the whole bank is one call per edge.
+    With zero_reg=True register 0 is hardwired to zero (like RISC-V x0).
+    """
+    def __init__(self, n = 32, zero_reg = False, reset_value = None):
+        self.zero_reg = zero_reg
+        self._vals = [reset_value] * n
+        self._writes = []
+        if zero_reg:
+            self._vals[0] = 0
+    def __len__(self):
+        return len(self._vals)
+    def out(self, i = None):
+        # read port, with no index a tuple of all values is returned
+        if i is None:
+            return tuple(self._vals)
+        return self._vals[i]
+    def reset(self, value, i = None):
+        # asynchronous (re)set of register i, or all registers
+        if i is None:
+            self._vals[:] = [value] * len(self._vals)
+        else:
+            self._vals[i] = value
+        if self.zero_reg:
+            self._vals[0] = 0
+    def write(self, i, value):
+        # request a write of register i, committed at the next clock
+        self._writes.append((i, value))
+    def clock(self, *writes):
+        # the system passes in the write ports, each is an (index, value) 
+        # pair or None for no write. They are committed with any write() 
+        # requests, later writes to the same register win.
+        vals = self._vals
+        for w in writes:
+            if w is not None:
+                vals[w[0]] = w[1]
+        if self._writes:
+            for i, v in self._writes:
+                vals[i] = v
+            self._writes.clear()
+        if self.zero_reg:
+            vals[0] = 0
+    def checkpoint(self):
+        # the state saved by System.checkpoint, pending writes included
+        return tuple(self._vals), tuple(self._writes)
+    def restore(self, state):
+        vals, writes = state
+        self._vals[:] = vals
+        self._writes[:] = writes
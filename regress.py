@@ -0,0 +1,168 @@
+"""
+regress.py
+==========
+Runs many independent ELF programs through a simulation model in a pool of
+processes and collects pass/fail results, like a regression farm on one box.
+
+A model is any importable callable (given as "module:function") with the
+signature model(sys_mem, symbols, cycles, probe_addr). It simulates the
+program loaded in sys_mem (see load_elf) for at most cycles, it may stop
+early once the probe word was written, and returns the cycles it ran.
+
+After the run the probe word (the riscv-tests tohost symbol by default) is
+read: 1 is a pass, any other non zero value a failure (riscv-tests report
+the failing test number as tohost >> 1) and 0 means the program did not
+finish within the cycle budget.
+
+The default model is the functional instruction set simulator riscv.iss.
+
+Run as: python -m pydigital.regress [-m module:model] [-j processes] elffile...
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import importlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.etree import ElementTree
+from .elfloader import load_elf
+from .memory import Memory
+
+Job = namedtuple('Job', 'elffile cycles probe timeout', defaults = (10**6, 'tohost', None))
+# status is one of pass, fail, unfinished, timeout or error
+Result = namedtuple('Result', 'job status value cycles seconds message')
+
+class JobTimeout(Exception):
+    pass
+
+def load_model(name):
+    "import a model given as module:function"
+    module, _sep, fn = name.partition(':')
+    if not fn:
+        raise ValueError(f"Model {name} must be given as module:function.")
+    return getattr(importlib.import_module(module), fn)
+
+# worker state, set once per process by _init
+_model = None
+_cache = None
+
+def _init(model, cache):
+    global _model, _cache
+    _model = load_model(model)
+    _cache = cache
+
+def _timeout(signum, frame):
+    raise JobTimeout()
+
+def run_job(job, model = None, cache = None):
+    "load and simulate one job, returns its Result"
+    model = model or _model
+    start = time.perf_counter()
+    cycles, value = 0, None
+    if job.timeout:
+        signal.signal(signal.SIGALRM, _timeout)
+        signal.setitimer(signal.ITIMER_REAL, job.timeout)
+    try:
+        sys_mem, symbols = load_elf(job.elffile, quiet = True, cache = cache or _cache)
+        if job.probe not in symbols:
+            raise ValueError(f"Probe symbol {job.probe} not found.")
+        addr = symbols[job.probe]
+        cycles = model(sys_mem, symbols, job.cycles, addr)
+        value = Memory(sys_mem).out(addr, 4, signed = False)
+        if value == 0:
+            status, message = 'unfinished', f"{job.probe} not written in {job.cycles} cycles"
+        elif value == 1:
+            status, message = 'pass', ""
+        else:
+            status, message = 'fail', f"{job.probe} = {value} (test {value >> 1})"
+    except JobTimeout:
+        status, message = 'timeout', f"timed out after {job.timeout} s"
+    except Exception as err:
+        status, message = 'error', f"{type(err).__name__}: {err}"
+    finally:
+        if job.timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return Result(job, status, value, cycles, time.perf_counter() - start, message)
+
+def run(jobs, model, processes = None, cache = None):
+    """
+    generator of the Results of jobs as they finish, model is a module:function
+    name that every worker imports. processes=1 runs the jobs in this process.
+    """
+    if processes == 1:
+        _init(model, cache)
+        for job in jobs:
+            yield run_job(job)
+        return
+    with ProcessPoolExecutor(processes, initializer = _init,
+            initargs = (model, cache)) as pool:
+        futures = [pool.submit(run_job, job) for job in jobs]
+        for f in as_completed(futures):
+            yield f.result()
+
+def summary(results, model = None):
+    "a JSON compatible summary of a list of results"
+    counts = {}
+    for r in results:
+        counts[r.status] = counts.get(r.status, 0) + 1
+    return {
+        "model": model,
+        "total": len(results),
+        "counts": counts,
+        "seconds": sum(r.seconds for r in results),
+        "results": [{"elffile": r.job.elffile, "status": r.status, "value": r.value,
+            "cycles": r.cycles, "seconds": r.seconds, "message": r.message}
+            for r in results],
+    }
+
+def junit(results, filename, name = "regression"):
+    "write the results as a JUnit XML report"
+    suite = ElementTree.Element("testsuite", name = name, tests = str(len(results)),
+        failures = str(sum(r.status in ('fail', 'unfinished') for r in results)),
+        errors = str(sum(r.status in ('error', 'timeout') for r in results)),
+        time = f"{sum(r.seconds for r in results):.3f}")
+    for r in results:
+        case = ElementTree.SubElement(suite, "testcase", name = os.path.basename(r.job.elffile),
+            classname = os.path.dirname(r.job.elffile), time = f"{r.seconds:.3f}")
+        if r.status in ('fail', 'unfinished'):
+            ElementTree.SubElement(case, "failure", message = r.message)
+        elif r.status != 'pass':
+            ElementTree.SubElement(case, "error", message = r.message)
+    ElementTree.ElementTree(suite).write(filename, encoding = "utf-8", xml_declaration = True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Runs ELF programs through a model in a process pool.")
+    parser.add_argument("elffiles", nargs = "*")
+    parser.add_argument("-m", "--model", default = f"{__package__}.riscv.iss:model",
+        help = "model as module:function (default the instruction set simulator)")
+    parser.add_argument("-j", "--processes", type = int, default = None,
+        help = "worker processes (default one per core)")
+    parser.add_argument("--cycles", type = int, default = 10**6, help = "cycle budget per program")
+    parser.add_argument("--probe", default = "tohost", help = "pass/fail symbol")
+    parser.add_argument("--timeout", type = float, default = None, help = "seconds per program")
+    parser.add_argument("--jobs", help = "JSON list of jobs, objects with elffile and "
+        "optionally cycles, probe and timeout")
+    parser.add_argument("--cache", help = "load_elf image cache directory")
+    parser.add_argument("--json", help = "write a JSON summary to this file")
+    parser.add_argument("--junit", help = "write a JUnit XML report to this file")
+    args = parser.parse_args()
+    jobs = [Job(f, args.cycles, args.probe, args.timeout) for f in args.elffiles]
+    if args.jobs:
+        with open(args.jobs) as f:
+            jobs += [Job(**{"cycles": args.cycles, "probe": args.probe,
+                "timeout": args.timeout, **j}) for j in json.load(f)]
+    results = []
+    for r in run(jobs, args.model, args.processes, args.cache):
+        results.append(r)
+        print(f"{r.status.upper():10s} {r.job.elffile} {r.cycles} cycles {r.seconds:.2f} s {r.message}")
+    s = summary(results, args.model)
+    print(", ".join(f"{n} {status}" for status, n in sorted(s["counts"].items())))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(s, f, indent = 2)
+    if args.junit:
+        junit(results, args.junit)
+    sys.exit(0 if s["counts"].get('pass', 0) == len(results) else 1)
@@ -1 +1 @@
-from .isa import Instruction, BadInstruction
\ No newline at end of file
+from .isa import Instruction, BadInstruction, Decoded, decode, predecode
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+Vectorized field extraction for whole instruction streams with numpy.
+
+words() turns a .text section (bytes from Elf.sections(), a MemorySegment
+or a block view) into a uint32 array and decode_fields() extracts every
+field, the sign extended immediates and the mnemonic id (see isa.ops)
+of all the words in a single pass.
+"""
+import numpy as np
+from .isa import dispatch_tables
+
+fields_dtype = np.dtype([
+    ('val', np.uint32), ('id', np.int16), ('op', np.uint8),
+    ('rd', np.uint8), ('rs1', np.uint8), ('rs2', np.uint8),
+    ('func3', np.uint8), ('func7', np.uint8),
+    ('i_imm', np.int32), ('s_imm', np.int32), ('sb_imm', np.int32),
+    ('u_imm', np.int32), ('uj_imm', np.int32), ('z_imm', np.uint8)])
+
+_dispatch, _system, _priv = dispatch_tables()
+
+def _id_table():
+    "mnemonic ids indexed by the opcode, funct3 and funct7 bits (-1 is invalid, -2 is SYSTEM)"
+    ids = np.full(1 << 17, -1, dtype=np.int16)
+    for key, info in _dispatch.items():
+        k = (key & 0x7f) | (((key >> 12) & 0x7) << 7) | ((key >> 25) << 10)
+        ids[k] = -2 if info is _priv else info.id
+    return ids
+
+_ids = _id_table()
+
+def words(data, byteorder = 'little'):
+    """
+    view an instruction stream as an array of uint32 words, data is bytes-like
+    or a memory segment (its data and byteorder are used)
+    """
+    if hasattr(data, 'byteorder') and hasattr(data, 'data'):
+        data, byteorder = data.data, data.byteorder
+    dt = np.dtype('<u4' if byteorder == 'little' else '>u4')
+    w = np.frombuffer(data, dtype=dt, count=len(data) // 4)
+    return w.astype(np.uint32)
+
+def decode_fields(w):
+    """
+    decodes an array of instruction words into a structured array of
+    fields_dtype, invalid words have an id of -1
+    """
+    w = np.asarray(w, dtype=np.uint32)
+    u = w.astype(np.int64)
+    s = w.view(np.int32).astype(np.int64) # arithmetic shifts sign extend
+    out = np.empty(w.shape, dtype=fields_dtype)
+    out['val'] = w
+    out['op'] = u & 0x7f
+    out['rd'] = (u >> 7) & 0x1f
+    out['rs1'] = (u >> 15) & 0x1f
+    out['rs2'] = (u >> 20) & 0x1f
+    out['func3'] = (u >> 12) & 0x7
+    out['func7'] = u >> 25
+    out['i_imm'] = s >> 20
+    out['s_imm'] = ((s >> 25) << 5) | ((u >> 7) & 0x1f)
+    out['sb_imm'] = (((s >> 31) << 12) | (((u >> 7) & 0x1) << 11) |
+                     (((u >> 25) & 0x3f) << 5) | (((u >> 8) & 0xf) << 1))
+    out['u_imm'] = s & ~0xfff
+    out['uj_imm'] = (((s >> 31) << 20) | (((u >> 12) & 0xff) << 12) |
+                     (((u >> 20) & 0x1) << 11) | (((u >> 21) & 0x3ff) << 1))
+    out['z_imm'] = (u >> 15) & 0x1f
+
+    ids = _ids[(u & 0x7f) | (((u >> 12) & 0x7) << 7) | ((u >> 25) << 10)]
+    priv = ids == -2
+    if priv.any():
+        # ecall/ebreak/xret are selected by the upper word, there are few of them
+        upper = u[priv] >> 7
+        keys, inverse = np.unique(upper, return_inverse=True)
+        lut = np.array([_system[k].id if k in _system else -1 for k in keys.tolist()],
+            dtype=np.int16)
+        ids[priv] = lut[inverse]
+    out['id'] = ids
+    return out
@@ -0,0 +1,95 @@
+"""
+An objdump style disassembler for RV32 ELF binaries using the project's own
+decoder, so listings match what the simulator executes.
+
+The executable sections are read in chunks which are decoded in a process
+pool, the listing is streamed back in address order with symbol headers.
+
+Run as: python -m pydigital.riscv.disasm [-j processes] elffile
+"""
+import os
+import sys
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from ..elfloader import Elf
+from .isa import Instruction, BadInstruction
+
+# worker state, set once per process by _init
+_symbols = {}
+_byteorder = 'little'
+
+def _init(symbols, byteorder):
+    global _symbols, _byteorder
+    _symbols = symbols
+    _byteorder = byteorder
+
+def _disasm_chunk(addr, data):
+    "list the lines of one chunk of instructions starting at addr"
+    lines = []
+    for off in range(0, len(data) - 3, 4):
+        pc = addr + off
+        val = int.from_bytes(data[off:off+4], byteorder = _byteorder)
+        if pc in _symbols:
+            lines.append(f"\n{pc:08x} <{_symbols[pc]}>:")
+        try:
+            asm = str(Instruction(val, pc, _symbols))
+        except BadInstruction:
+            asm = f".word\t0x{val:08x}"
+        lines.append(f"{pc:8x}:\t{val:08x}          \t{asm}")
+    return lines
+
+def _chunks(e, chunk_size):
+    "yields (section header or None, addr, data) chunks read from the file"
+    for name, addr, offset, size in e.exec_sections():
+        header = f"\nDisassembly of section {name}:"
+        for pos in range(0, size, 4 * chunk_size):
+            e.f.seek(offset + pos)
+            yield header, addr + pos, e.f.read(min(4 * chunk_size, size - pos))
+            header = None
+
+def disassemble(elffile, processes = None, chunk_size = 4096):
+    """
+    generator of listing lines for the executable sections of elffile.
+    Chunks of chunk_size words are decoded by a pool of processes (None is
+    one per core, 1 decodes in this process), at most two chunks per 
+    process are in flight so memory stays bounded.
+    """
+    with Elf(elffile, quiet = True) as e:
+        symbols = e.symbols
+        if processes == 1:
+            _init(symbols, e.byteorder)
+            for header, addr, data in _chunks(e, chunk_size):
+                if header:
+                    yield header
+                yield from _disasm_chunk(addr, data)
+            return
+        processes = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(processes, initializer = _init,
+                initargs = (symbols, e.byteorder)) as pool:
+            window = 2 * processes
+            pending = deque()
+            for header, addr, data in _chunks(e, chunk_size):
+                pending.append((header, pool.submit(_disasm_chunk, addr, data)))
+                if len(pending) >= window:
+                    header, lines = pending.popleft()
+                    if header:
+                        yield header
+                    yield from lines.result()
+            while pending:
+                header, lines = pending.popleft()
+                if header:
+                    yield header
+                yield from lines.result()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.strip().split('\n')[0])
+    parser.add_argument("elffile")
+    parser.add_argument("-j", "--processes", type = int, default = None,
+        help = "worker processes (default one per core)")
+    parser.add_argument("--chunk", type = int, default = 4096,
+        help = "words per chunk")
+    args = parser.parse_args()
+    out = sys.stdout
+    for line in disassemble(args.elffile, args.processes, args.chunk):
+        out.write(line + '\n')
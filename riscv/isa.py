@@ -1,33 +1,44 @@
+import sys
+from collections import namedtuple
+from functools import lru_cache
 from .csr_list import csrs
+from .decoder import control
 class BadInstruction(Exception):
     pass
 
 # build csr lookup
 csrd = {k:v for k,v in csrs}
 
-def regNumToName(num):
-    if type(num) != int or num < 0 or num > 31:
-        raise BadInstruction()
-    return ['zero','ra','sp','gp',  # 0..3
+# abi register names, indexed by register number
+regNames = ('zero','ra','sp','gp',  # 0..3
             'tp', 't0', 't1', 't2', # 4..7
             's0', 's1', 'a0', 'a1', # 8..11
             'a2', 'a3', 'a4', 'a5', # 12..15
             'a6', 'a7', 's2', 's3', # 16..19
             's4', 's5', 's6', 's7', # 20..23
-            's8', 's9', 's10', 's11', # 24..27]
-            't3', 't4', 't5', 't6'][num] # 28..31
+            's8', 's9', 's10', 's11', # 24..27
+            't3', 't4', 't5', 't6') # 28..31
+
+def regNumToName(num):
+    if type(num) != int or num < 0 or num > 31:
+        raise BadInstruction()
+    return regNames[num]
 class Instruction():
     "represents/decodes RISCV instructions"    
-    def __init__ (self, val, pc, symbols = {}):
+    def __init__ (self, val, pc, symbols = {}, text = True):
         """
         Decodes a risc-v instruction word
         val is the machine code word
         pc is the pc value used to format pc-relative assembly instructions
         symbols is an optional symbol table to decode addresses in assembly output 
+        text=False skips the assembly text entirely (asm is None), only the
+        fields used for execution are decoded
         """
         self.val = val        
         self.pc = pc # pc relative instrs need pc to compute targets for display
         self.symbols = symbols
+        self._text = text
+        self._asm = None # built on first use, see asm
         if val == None:
             self.name = "None"
             return
@@ -57,45 +68,28 @@ class Instruction():
         self.u_imm = self.sextend(0xfffff000 & self.val, 32)
         # u_imm is already 32-bits, don't have to sign extend, that would make it wrong!
         #self.u_imm = 0xfffff000 & self.val
-        self.uj_imm = self.sextend(0xfffff & 
+        # imm[20|10:1|11|19:12], 21 bits with the sign in bit 20
+        self.uj_imm = self.sextend(0x1fffff & 
             (
                 ((0x3ff & (self.val >> 21)) << 1) |
                 ((0x1 & (self.val >> 20)) << 11) |
                 ((0xff & (self.val >> 12)) << 12) |
                 ((0x1 & (self.val >> 31)) << 20)
-            ), 20)
+            ), 21)
         # special case for CSR instructions, immediate val is stored in rs1's place.
         self.z_imm = 0x1f & (self.val >> 15)
-        # instruction name
-        self.name = "" # to be filled in later by a decoder
-
-        # extra flags for special instruction types
-        self.is_branch = False
-        self.is_jump = False
-        self.is_jump_reg = False
-        self.is_csr = False
-
-        # indexed by bits 4:2 of instruction    
-        self.decoders = [
-            self.LOAD_STORE_BRANCH,         # 000
-            self.LOADFP_STOREFP_JALR,
-            None,                           # 010 custom-0
-            self.MISCMEM_JAL,
-            self.OP_OPIMM_SYSTEM,           # 100
-            self.AUIPC_LUI,
-            self.OP32_OPIMM32,              # 110
-            None,                           # 111 expansion
-        ]
-        # https://riscv.org/wp-content/uploads/2017/05/riscv-spec-v2.2.pdf
-        # page 103
-   
-        if self.op & 0b11 != 0b11:
-            raise BadInstruction()
-        decoder = self.decoders[0b111 & (self.op >> 2)] #4:2
-        if decoder != None:
-            decoder()
-        else:
-            raise BadInstruction()
+        # instruction name and flags come straight from the dispatch table
+        info = lookup(val)
+        self.info = info
+        self.name = info.name
+        self.is_branch = info.is_branch
+        self.is_jump = info.is_jump
+        self.is_jump_reg = info.is_jump_reg
+        self.is_csr = info.is_csr
+        if info.is_csr:
+            self.csr = 0xfff & (self.val >> 20)
+        if info.fmt == 'SH':
+            self.shamt = self.rs2
 
     def dump(self):
         "dump all instruction details, useful for debugging"
@@ -109,7 +103,7 @@ class Instruction():
         s += '\n' + ", ".join([f'{_n.rjust(10)}: {format(getattr(self, _n), "8x")}' for _n in f])
 
         if self.is_csr:
-            s += f'\n{"csr".rjust(10)}: {format(self.csr, "08x")} == {csrd[self.csr]}'
+            s += f'\n{"csr".rjust(10)}: {format(self.csr, "08x")} == {csrd.get(self.csr, f"0x{self.csr:x}")}'
         return s
 
     def sextend(self, val, c):
@@ -132,9 +126,12 @@ class Instruction():
         if self.val is None:
             return "None"
         # match objdump (or spike) output
-        if hasattr(self, 'asm'):
-            #return f'{self.val:08x}\t{self.asm}'
-            return f'{self.asm}'
+        if not self._text:
+            return self.name
+        asm = self.asm
+        if asm is not None:
+            #return f'{self.val:08x}\t{asm}'
+            return asm
         else:            
             #s = [f'{self.val:08x}\t',
             s = [\
@@ -142,224 +139,349 @@ class Instruction():
                 'NO DECODER']
             return " ".join(s)
 
-    ######################### decoder functions begin
-    def LOAD_STORE_BRANCH(self):    
-        if 0b11 & (self.op >> 5) == 0b00:
-            #LOAD            
-            self.name = {
-                0x0: 'lb',
-                0x1: 'lh',
-                0x2: 'lw',
-                0x4: 'lbu',
-                0x5: 'lhu'
-            }[self.func3]
-            self.asm = f"{self.name}\t{regNumToName(self.rd)},{self.i_imm}({regNumToName(self.rs1)})"
-
-        elif 0b11 & (self.op >> 5) == 0b01:
-            #STORE
-            self.name = {
-                0b000: 'sb',
-                0b001: 'sh',
-                0b010: 'sw'
-            }[self.func3]
-            self.asm = f"{self.name}\t{regNumToName(self.rs2)},{self.s_imm}({regNumToName(self.rs1)})"
+    ######################### assembly text begin
+    @property
+    def asm(self):
+        "assembly text (objdump style), built on first access and cached"
+        if self._asm is None and self._text and self.name:
+            self._asm = self.format_asm()
+        return self._asm
 
-        elif 0b11 & (self.op >> 5) == 0b10:
-            #MADD
-            self.name = 'madd'
-            raise NotImplementedError()
-        elif 0b11 & (self.op >> 5) == 0b11:
-            #BRANCH
-            self.is_branch = True
-            self.name = [
-                'beq', #000
-                'bne',
-                '---', #010 ?
-                '---', #011 ?
-                'blt', #100
-                'bge', #101
-                'bltu', #110
-                'bgeu', #111
-            ][self.func3]
-            if self.name == '---':
-                raise BadInstruction()
-            elif self.rs1 == 0:
+    def format_asm(self):
+        "formats the decoded instruction as assembly, returns None if there is no formatter"
+        n = self.name
+        if n in _loads:
+            return f"{n}\t{regNames[self.rd]},{self.i_imm}({regNames[self.rs1]})"
+        elif n in _stores:
+            return f"{n}\t{regNames[self.rs2]},{self.s_imm}({regNames[self.rs1]})"
+        elif self.is_branch:
+            target = self.pc + self.sb_imm
+            if self.rs1 == 0:
                 # pseudo instruction   
-                self.asm = f"{self.name}z\t{regNumToName(self.rs2)},pc{self.sb_imm:+d}\t({self.pc + self.sb_imm:x})"
+                asm = f"{n}z\t{regNames[self.rs2]},pc{self.sb_imm:+d}\t({target:x})"
             elif self.rs2 == 0:
                 # pseudo instruction
-                self.asm = f"{self.name}z\t{regNumToName(self.rs1)},pc{self.sb_imm:+d}\t({self.pc + self.sb_imm:x})"
+                asm = f"{n}z\t{regNames[self.rs1]},pc{self.sb_imm:+d}\t({target:x})"
             else:
-                self.asm = f"{self.name}\t{regNumToName(self.rs1)},{regNumToName(self.rs2)},pc{self.sb_imm:+d}\t({self.pc + self.sb_imm:x})"
-
-            if self.pc + self.sb_imm in self.symbols:
-                self.asm += f' <{self.symbols[self.pc + self.sb_imm]}>'                
-        else:
-            raise BadInstruction()
-
-    def LOADFP_STOREFP_JALR(self):
-        #JALR instruction here
-        if self.op == 0b1100111 and self.func3 == 0b000:
-            self.is_jump_reg = True
-            self.name = 'jalr'
+                asm = f"{n}\t{regNames[self.rs1]},{regNames[self.rs2]},pc{self.sb_imm:+d}\t({target:x})"
+            if target in self.symbols:
+                asm += f' <{self.symbols[target]}>'
+            return asm
+        elif self.is_jump_reg:
             if self.rd == 0:
                 if self.rs1 == 1 and self.i_imm == 0:
-                    self.asm = 'ret'
+                    asm = 'ret'
                 else:
-                    self.asm = f'jr\t{regNumToName(self.rs1)}'
-                
+                    asm = f'jr\t{regNames[self.rs1]}'
             else:
-                self.asm = f'{self.name}\t{regNumToName(self.rd)},{regNumToName(self.rs1)}'
+                asm = f'{n}\t{regNames[self.rd]},{regNames[self.rs1]}'
             if self.i_imm > 0:
-                self.asm += f'\t({self.i_imm:x})'
-        else:
-            raise NotImplementedError() 
-    def MISCMEM_JAL(self):
-        if 0b11 & (self.op >> 5) == 0b11:
-            # jumps
-            self.is_jump = True
-            self.name = 'jal'
+                asm += f'\t({self.i_imm:x})'
+            return asm
+        elif self.is_jump:
+            target = self.pc + self.uj_imm
             if self.rd == 0:
                 # j pseudo instruction
-                self.asm = f"j\t{(self.pc + self.uj_imm):8x}"
+                asm = f"j\t{target:8x}"
             else:                
-                self.asm = f"{self.name}\t{regNumToName(self.rd)},{(self.pc + self.uj_imm):8x}"
-            if self.pc + self.uj_imm in self.symbols:
-                self.asm += f'\t<{self.symbols[self.pc + self.uj_imm]}>'
-        elif self.op == 0b0001111 and self.func3 == 0b000:
-            # not fully implemented/decoded
-            self.name = 'fence'
-            self.asm = 'fence'
-        else:
-            print("MISCMEM:\n" + self.dump())
-            raise NotImplementedError()
-    def OP_OPIMM_SYSTEM(self):
-        if 0b11 & (self.op >> 5) == 0b00:          
-            self.name = [
-                'addi',# 0 
-                'slli',
-                'slti',
-                'sltiu',
-                'xori', # 4
-                'srli',
-                'ori',
-                'andi', # 7
-            ][self.func3]
-
-            self.asm = f"{self.name}\t{regNumToName(self.rd)},{regNumToName(self.rs1)},{self.i_imm}"
-            # special cases
-            if self.name == 'addi' and self.rs1 == 0b0:
+                asm = f"{n}\t{regNames[self.rd]},{target:8x}"
+            if target in self.symbols:
+                asm += f'\t<{self.symbols[target]}>'
+            return asm
+        elif n in _no_operands:
+            return n
+        elif self.is_csr:
+            pname = n
+            # pseudo name generation
+            if self.rd == 0:
+                # drop inner r
+                pname = n[0:3] + n[4:]     
+            asm = []
+            # not pseudo op
+            if self.rd != 0:                    
+                asm += [regNames[self.rd]]
+            # csrs without a name are numeric, like objdump
+            asm += [csrd.get(self.csr, f"0x{self.csr:x}")]
+            if n[-1] == 'i':
+                # rs1 is used as the immediate value
+                asm += [str(self.rs1)]
+            else:
+                if self.rs1 != 0:
+                    asm += [regNames[self.rs1]]
+            return f"{pname}\t" + ",".join(asm)
+        elif n in _opimm:
+            if n == 'addi' and self.rs1 == 0b0:
                 # cosmetic, psuedo op translation                
-                self.asm = f"li\t{regNumToName(self.rd)},{self.i_imm}"
+                return f"li\t{regNames[self.rd]},{self.i_imm}"
+            if self.func3 == 0b101 or self.func3 == 0b001:
+                # shift immediates are printed in hex
+                return f"{n}\t{regNames[self.rd]},{regNames[self.rs1]},0x{self.i_imm:x}"
+            return f"{n}\t{regNames[self.rd]},{regNames[self.rs1]},{self.i_imm}"
+        elif n in _op:
+            return f"{n}\t{regNames[self.rd]},{regNames[self.rs1]},{regNames[self.rs2]}"
+        elif n in ('lui', 'auipc'):
+            # objdump output doesn't show trailing 12-bit of zeros for display
+            # and it shows the unsigned value
+            return f"{n}\t{regNames[self.rd]},0x{(0xfffff000 & self.val)>>12:05x}"
+        return None
+    ######################### assembly text end
 
-            if self.func3 == 0b101:
-                self.shamt = 0x1f & (self.op >> 20)
-                if self.func7 == 0b0100000:
-                    self.name = 'srai'
-                    self.asm = f"{self.name}\t{regNumToName(self.rd)},{regNumToName(self.rs1)},0x{self.i_imm:x}"
-                else:
-                    # shift immediates are printed in hex
-                    self.asm = f"{self.name}\t{regNumToName(self.rd)},{regNumToName(self.rs1)},0x{self.i_imm:x}"
-                
-            if self.func3 == 0b001:
-                self.shamt = 0x1f & (self.op >> 20)
-                self.asm = f"{self.name}\t{regNumToName(self.rd)},{regNumToName(self.rs1)},0x{self.i_imm:x}"
+# instruction groups used to pick the assembly format
+_loads = ('lb', 'lh', 'lw', 'lbu', 'lhu')
+_stores = ('sb', 'sh', 'sw')
+_opimm = ('addi', 'slli', 'slti', 'sltiu', 'xori', 'srli', 'srai', 'ori', 'andi')
+_op = ('add', 'sub', 'sll', 'slt', 'sltu', 'xor', 'srl', 'sra', 'or', 'and')
+_no_operands = ('fence', 'ecall', 'ebreak', 'uret', 'sret', 'hret', 'mret')
 
-        elif 0b11 & (self.op >> 5) == 0b01:
-            # opcodes: 01100xx
-            self.name = [
-                'add',# 0  (also sub)
-                'sll',
-                'slt',
-                'sltu',
-                'xor', # 4
-                'srl', # and sra
-                'or',
-                'and', # 7
-            ][self.func3]
-            if self.func3 == 5 and self.func7 == 0b0100000:
-                self.name = 'sra'
-            if self.func3 == 0 and self.func7 == 0b0100000:
-                self.name = 'sub'
-            self.asm = f"{self.name}\t{regNumToName(self.rd)},{regNumToName(self.rs1)},{regNumToName(self.rs2)}"
-            
-        elif 0b11 & (self.op >> 5) == 0b10:
-            self.name = 'op-fp'
-            raise NotImplementedError() 
-        elif 0b11 & (self.op >> 5) == 0b11:
-                
-            if (self.val >> 7) == 0:
-                self.name = 'ecall'
-                self.asm = self.name
-            elif (self.val >> 7) == 0b0000000000010000000000000:
-                self.name = 'ebreak'
-                self.asm = self.name
-            else:          
-                self.csr = 0xfff & (self.val >> 20)
-                self.is_csr = True
-                
-                # system opcodes are messy
-                if self.csr == 0 and self.rs1 == 0 and self.func3 == 0 and self.rd == 0:
-                    self.name = 'ecall'
-                    self.asm = 'ecall'                    
-                elif self.csr == 1 and self.rs1 == 0 and self.func3 == 0 and self.rd == 0:
-                    self.name = 'ebreak' 
-                    self.asm = 'ebreak'
-                elif self.func3 == 0 and self.rs1 == 0 and self.rd == 0:
-                    # Uret/Sret/Hret/Mret
-                    if self.i_imm == 0b000000000010:
-                        self.name, self.asm ='uret', 'uret'
-                    elif self.i_imm == 0b000100000010:
-                        self.name, self.asm ='sret', 'sret'
-                    elif self.i_imm == 0b01000000010:
-                        self.name, self.asm ='hret', 'hret'
-                    elif self.i_imm == 0b001100000010:
-                        self.name, self.asm ='mret', 'mret'
-                    else:
-                        raise ValueError("Unsupported instruction")
-                else:
-                    self.name = [
-                        '---', # ecall or ebreak
-                        'csrrw',
-                        'csrrs',
-                        'csrrc',
-                        '---' # 4
-                        'csrrwi',
-                        'csrrsi',
-                        'csrrci'
-                    ][self.func3]                          
-                    pname = self.name
-                    # pseudo name generation
-                    if self.rd == 0:
-                        # drop inner r
-                        pname = self.name[0:3] + self.name[4:]     
-                    asm = []
-                    # not pseudo op
-                    if self.rd != 0:                    
-                        asm += [regNumToName(self.rd)]
 
-                    asm += [csrd[self.csr]]
-                    
-                    if self.name[-1] == 'i':
-                        # rs1 is used as the immediate value
-                        asm += [str(self.rs1)]
-                    else:
-                        if self.rs1 != 0:
-                            asm += [regNumToName(self.rs1)]
-                    self.asm = f"{pname}\t" + ",".join(asm)                                      
-        else:
-            raise BadInstruction()
-    def AUIPC_LUI(self):                
-        if self.op == 0b0110111:
-            self.name = 'lui'
-        elif self.op == 0b0010111:
-            self.name = 'auipc'
-        else:
+# RV32I encodings, - matches any value of the field. The format selects
+# the immediate: R (none), I, SH (shift amount), S, B, U, J
+_encodings = """Inst    opcode  funct3  funct7  fmt
+lui     0110111 -       -       U
+auipc   0010111 -       -       U
+jal     1101111 -       -       J
+jalr    1100111 000     -       I
+beq     1100011 000     -       B
+bne     1100011 001     -       B
+blt     1100011 100     -       B
+bge     1100011 101     -       B
+bltu    1100011 110     -       B
+bgeu    1100011 111     -       B
+lb      0000011 000     -       I
+lh      0000011 001     -       I
+lw      0000011 010     -       I
+lbu     0000011 100     -       I
+lhu     0000011 101     -       I
+sb      0100011 000     -       S
+sh      0100011 001     -       S
+sw      0100011 010     -       S
+addi    0010011 000     -       I
+slti    0010011 010     -       I
+sltiu   0010011 011     -       I
+xori    0010011 100     -       I
+ori     0010011 110     -       I
+andi    0010011 111     -       I
+slli    0010011 001     0000000 SH
+srli    0010011 101     0000000 SH
+srai    0010011 101     0100000 SH
+add     0110011 000     0000000 R
+sub     0110011 000     0100000 R
+sll     0110011 001     0000000 R
+slt     0110011 010     0000000 R
+sltu    0110011 011     0000000 R
+xor     0110011 100     0000000 R
+srl     0110011 101     0000000 R
+sra     0110011 101     0100000 R
+or      0110011 110     0000000 R
+and     0110011 111     0000000 R
+fence   0001111 000     -       I
+csrrw   1110011 001     -       I
+csrrs   1110011 010     -       I
+csrrc   1110011 011     -       I
+csrrwi  1110011 101     -       I
+csrrsi  1110011 110     -       I
+csrrci  1110011 111     -       I"""
+
+# SYSTEM instructions with funct3 == 0, keyed by instruction >> 7
+_system_encodings = """Inst    key
+ecall   0x0
+ebreak  0x2000
+uret    0x4000
+sret    0x204000
+hret    0x404000
+mret    0x604000"""
+
+class OpInfo(namedtuple('OpInfo', ('id', 'name', 'fmt', 'control',
+        'is_branch', 'is_jump', 'is_jump_reg', 'is_csr'))):
+    "one entry of the dispatch table, control is the decoder.control entry (or None)"
+    __slots__ = ()
+
+# the dispatch table is indexed by the opcode, funct3 and funct7 bits
+_dispatch_mask = 0xfe00707f
+# marker for SYSTEM/funct3 0, resolved through _system
+_priv = OpInfo(-1, 'priv', 'I', None, False, False, False, False)
+
+def _build_dispatch():
+    "builds the dispatch tables, this is only run once at import"
+    dispatch, system, ops = {}, {}, []
+    def new_op(name, fmt, is_csr):
+        info = OpInfo(len(ops), name, fmt, control.get(name), 
+            fmt == 'B', name == 'jal', name == 'jalr', is_csr)
+        ops.append(info)
+        return info
+    for line in _encodings.split('\n')[1:]:
+        name, op, f3, f7, fmt = line.split()
+        info = new_op(name, fmt, name.startswith('csr'))
+        for funct3 in (range(8) if f3 == '-' else [int(f3, 2)]):
+            for funct7 in (range(128) if f7 == '-' else [int(f7, 2)]):
+                dispatch[int(op, 2) | (funct3 << 12) | (funct7 << 25)] = info
+    for funct7 in range(128):
+        dispatch[0b1110011 | (funct7 << 25)] = _priv
+    for line in _system_encodings.split('\n')[1:]:
+        name, key = line.split()
+        # ecall and ebreak are not decoded as csr instructions
+        system[int(key, 16)] = new_op(name, 'I', name.endswith('ret'))
+    return dispatch, system, tuple(ops)
+
+_dispatch, _system, ops = _build_dispatch()
+
+def dispatch_tables():
+    """
+    the decode tables (dispatch, system, priv) used by lookup: dispatch maps
+    the opcode, funct3 and funct7 bits of a word to its OpInfo, the priv 
+    entry means the word is found in system by its upper bits (word >> 7)
+    """
+    return _dispatch, _system, _priv
+
+def lookup(val):
+    "returns the dispatch table entry (OpInfo) for an instruction word"
+    info = _dispatch.get(val & _dispatch_mask)
+    if info is None:
+        raise BadInstruction()
+    if info is _priv:
+        # ecall/ebreak/xret are selected by the whole upper word
+        info = _system.get(val >> 7)
+        if info is None:
             raise BadInstruction()
-        # objdump output doesn't show trailing 12-bit of zeros for display
-        # and it shows the unsigned value
-        self.asm = f"{self.name}\t{regNumToName(self.rd)},0x{(0xfffff000 & self.val)>>12:05x}"
+    return info
+
+def _sext(val, c):
+    "sign extend a c bit value to a python integer"
+    if (val >> (c - 1)) & 1:
+        return val - (1 << c)
+    return val
+
+def _immediate(info, val):
+    "decodes only the immediate used by the instruction format"
+    fmt = info.fmt
+    if fmt == 'I':
+        if info.is_csr:
+            return 0xfff & (val >> 20) # the csr number
+        return _sext(0xfff & (val >> 20), 12)
+    elif fmt == 'SH':
+        return 0x1f & (val >> 20)
+    elif fmt == 'S':
+        return _sext((0x1f & (val >> 7)) | ((0x7f & (val >> 25)) << 5), 12)
+    elif fmt == 'B':
+        return _sext(((0xf & (val >> 8)) << 1) | ((0x3f & (val >> 25)) << 5) |
+                     ((0x1 & (val >> 7)) << 11) | ((0x80000000 & val) >> 19), 13)
+    elif fmt == 'U':
+        return _sext(0xfffff000 & val, 32)
+    elif fmt == 'J':
+        return _sext(((0x3ff & (val >> 21)) << 1) | ((0x1 & (val >> 20)) << 11) |
+                     ((0xff & (val >> 12)) << 12) | ((0x1 & (val >> 31)) << 20), 21)
+    return 0
+
+class Decoded:
+    """
+    A compact, immutable, pc independent decode of one instruction word.
+    Only the execution fields are stored: the registers, the one immediate 
+    used by the format (the csr number for csr instructions) and the shared
+    dispatch table entry which holds the mnemonic id and control signals.
+
+    Records are shared by every pc holding the same word, use target() and 
+    disasm() for the pc relative parts. A record is 80 bytes plus its 
+    immediate (see footprint), an Instruction is several hundred bytes.
+    """
+    __slots__ = ('val', 'info', 'rd', 'rs1', 'rs2', 'imm')
+    def __init__(self, val, info, rd, rs1, rs2, imm):
+        for name, v in zip(self.__slots__, (val, info, rd, rs1, rs2, imm)):
+            object.__setattr__(self, name, v)
+    def __setattr__(self, name, value):
+        raise AttributeError("Decoded records are shared and read-only")
+    def __repr__(self):
+        if self.val is None:
+            return "Decoded(None)"
+        return f"Decoded({self.val:08x} {self.name})"
+    @property
+    def id(self):
+        "mnemonic id, the index of the entry in ops"
+        return self.info.id
+    @property
+    def name(self):
+        return self.info.name
+    @property
+    def control(self):
+        "control signals from decoder.control (None if not in the table)"
+        return self.info.control
+    @property
+    def is_branch(self):
+        return self.info.is_branch
+    @property
+    def is_jump(self):
+        return self.info.is_jump
+    @property
+    def is_jump_reg(self):
+        return self.info.is_jump_reg
+    @property
+    def is_csr(self):
+        return self.info.is_csr
+    def target(self, pc):
+        "the branch/jump target when located at pc, None if not pc relative"
+        if self.info.is_branch or self.info.is_jump:
+            return pc + self.imm
+        return None
+    def disasm(self, pc, symbols = {}):
+        "assembly text when located at pc, only built when asked for"
+        return str(Instruction(self.val, pc, symbols))
+
+# decode of a missing word (eg. fetch from an invalid pc)
+_none = OpInfo(-1, 'None', 'R', None, False, False, False, False)
+
+def _record(val):
+    "builds a Decoded record without the cache"
+    if val is None:
+        return Decoded(None, _none, None, None, None, None)
+    info = lookup(val)
+    return Decoded(val, info, 0x1f & (val >> 7), 0x1f & (val >> 15),
+        0x1f & (val >> 20), _immediate(info, val))
+
+@lru_cache(maxsize=4096)
+def decode(val):
+    """
+    Decodes an instruction word through a bounded LRU cache, 
+    returns a shared Decoded record. Hot loops decode the same few words
+    over and over so most calls are a single dict lookup.
+    Hit/miss counters are available from decode.cache_info().
+    """
+    return _record(val)
+
+def predecode(mem, begin_addr, end_addr):
+    """
+    Decodes every word of mem in [begin_addr, end_addr), returns a list 
+    indexed by (pc - begin_addr) // 4. Words that are not instructions
+    (data in .text) are None. Identical words share one record, so a 
+    whole program can stay predecoded in memory.
+    """
+    records = {}
+    out = []
+    for pc in range(begin_addr, end_addr, 4):
+        val = mem[pc]
+        r = records.get(val, False)
+        if r is False:
+            try:
+                r = _record(val)
+            except BadInstruction:
+                r = None
+            records[val] = r
+        out.append(r)
+    return out
 
-    def OP32_OPIMM32(self):
-        print("OPIMM32", end="")
-    ######################### decoder functions end
+def footprint(records):
+    """
+    Measures the memory used by a list of predecoded records, in bytes 
+    per instruction. Shared records are counted once, small integers 
+    are cached by python and not counted. The target is at most 100 bytes 
+    per instruction when every word is unique, the bundled benchmarks
+    predecode to 20-30 bytes per instruction.
+    """
+    seen = set()
+    total = sys.getsizeof(records)
+    for r in records:
+        if r is None or id(r) in seen:
+            continue
+        seen.add(id(r))
+        total += sys.getsizeof(r)
+        if not -5 <= r.imm <= 256:
+            total += sys.getsizeof(r.imm)
+    return total / max(1, len(records))
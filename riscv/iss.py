@@ -0,0 +1,316 @@
+"""
+A functional RV32I instruction set simulator, a fast golden model for
+fast-forwarding and cross-checking cycle level models.
+
+Each instruction word is decoded once per pc into a small tuple of operands
+chosen from its sodor control signals (decoder.control: br_type, op1_sel,
+op2_sel, ALU_fun, wb_sel, mem_em, mem_wr, mask_type and csr_cmd) and
+executed in a tight loop over a Memory. Stores to decoded code invalidate
+it. Only machine mode is modelled, with the few CSRs and the ecall/mret
+traps the riscv-tests environment needs, and the tohost/fromhost host
+interface (exit and write syscalls) of riscv-tests and the benchmarks.
+
+Run as: python -m pydigital.riscv.iss [-n instructions] elffile
+"""
+import io
+import sys
+import time
+import argparse
+from .isa import decode, BadInstruction
+from ..memory import Memory
+from ..elfloader import load_elf
+
+_M = 0xffffffff
+
+class Trap(Exception):
+    "a trap with no handler (mtvec is not set)"
+    pass
+
+def _sra(a, b):
+    return (((a ^ 0x80000000) - 0x80000000) >> (b & 0x1f)) & _M
+
+# indexed by decoder.enums["ALU_fun"]
+_alu = {
+    1: lambda a, b: a ^ b,
+    2: lambda a, b: a,
+    3: lambda a, b: int(a < b),
+    4: lambda a, b: a & b,
+    5: lambda a, b: (a + b) & _M,
+    6: lambda a, b: int((a ^ 0x80000000) < (b ^ 0x80000000)),
+    7: _sra,
+    8: lambda a, b: (a - b) & _M,
+    9: lambda a, b: a >> (b & 0x1f),
+    10: lambda a, b: (a << (b & 0x1f)) & _M,
+    11: lambda a, b: a | b,
+}
+
+# conditional branches, indexed by decoder.enums["br_type"]
+_branches = {
+    2: lambda a, b: a >= b,
+    3: lambda a, b: (a ^ 0x80000000) < (b ^ 0x80000000),
+    4: lambda a, b: a != b,
+    5: lambda a, b: (a ^ 0x80000000) >= (b ^ 0x80000000),
+    7: lambda a, b: a < b,
+    8: lambda a, b: a == b,
+}
+_BR_N, _BR_JR, _BR_J = 0, 1, 6
+_OP1_IMZ, _OP1_IMU = 1, 2
+_OP2_RS2, _OP2_PC = 0, 3
+_WB_CSR = 3
+
+# kinds of decoded operations
+(_RR, _RI, _LUI, _AUIPC, _LOAD, _STORE, _BRANCH, _JAL, _JALR,
+    _CSR, _SYSTEM, _NOP, _ILLEGAL) = range(13)
+
+# machine mode csrs
+MSTATUS, MISA, MTVEC, MEPC, MCAUSE, MTVAL, MHARTID = 0x300, 0x301, 0x305, 0x341, 0x342, 0x343, 0xf14
+# trap causes
+ILLEGAL_INSTRUCTION, BREAKPOINT, ECALL_U = 2, 3, 8
+# riscv-tests host interface syscalls
+SYS_write = 64
+
+class ISS:
+    """
+    Functional simulator of one RV32I hart. mem is a memory segment,
+    PagedMemory or ELFMemory (as returned by load_elf), pc the entry point.
+    tohost/fromhost are the host interface addresses, by default the symbols
+    of that name, a store to tohost stops run() when the program exits.
+    """
+    def __init__(self, mem, pc, symbols = {}, tohost = None, fromhost = None,
+            stdout = None):
+        self.mem = Memory(mem)
+        self.pc = pc
+        # x0 is never written, writes to it go to the extra sink register 32
+        self.regs = [0] * 33
+        self.csrs = {MISA: 0x40000100}
+        self.priv = 3
+        self.instret = 0
+        self.seconds = 0.0
+        self.exit_code = None
+        self.tohost = symbols.get('tohost') if tohost is None else tohost
+        self.fromhost = symbols.get('fromhost') if fromhost is None else fromhost
+        self.stdout = stdout or sys.stdout
+        self._code = {} # pc -> decoded operation
+        self._pages = {} # code page -> pcs decoded in it
+    @property
+    def halted(self):
+        return self.exit_code is not None
+    @property
+    def ips(self):
+        "instructions per second of the runs so far"
+        return self.instret / self.seconds if self.seconds else 0.0
+    def _decode(self, pc):
+        "decodes the word at pc into an operation tuple (kind, rd, rs1, rs2, imm, fn)"
+        try:
+            d = decode(self.mem.out(pc, 4, signed = False))
+        except (BadInstruction, IndexError):
+            return (_ILLEGAL, 0, 0, 0, 0, None)
+        c = d.control
+        rd = d.rd or 32
+        imm = d.imm & _M
+        if c is None:
+            op = (_ILLEGAL, 0, 0, 0, 0, None)
+        elif c.mem_em:
+            signed = d.name in ('lb', 'lh')
+            op = (_STORE if c.mem_wr else _LOAD, rd, d.rs1, d.rs2, imm, (c.mask_type, signed))
+        elif c.br_type == _BR_J:
+            op = (_JAL, rd, 0, 0, d.imm, None)
+        elif c.br_type == _BR_JR:
+            op = (_JALR, rd, d.rs1, 0, imm, None)
+        elif c.br_type != _BR_N:
+            op = (_BRANCH, rd, d.rs1, d.rs2, d.imm, _branches[c.br_type])
+        elif c.wb_sel == _WB_CSR:
+            # the immediate forms use the rs1 field as the source
+            op = (_CSR, rd, d.rs1, c.op1_sel == _OP1_IMZ, d.imm, c.csr_cmd)
+        elif not c.rf_wen:
+            op = (_SYSTEM if d.name in ('ecall', 'ebreak', 'mret') else _NOP,
+                0, 0, 0, 0, d.name)
+        elif c.op1_sel == _OP1_IMU:
+            op = (_AUIPC if c.op2_sel == _OP2_PC else _LUI, rd, 0, 0, imm, None)
+        elif c.op2_sel == _OP2_RS2:
+            op = (_RR, rd, d.rs1, d.rs2, 0, _alu[c.ALU_fun])
+        else:
+            op = (_RI, rd, d.rs1, 0, imm, _alu[c.ALU_fun])
+        self._code[pc] = op
+        self._pages.setdefault(pc >> 12, []).append(pc)
+        return op
+    def _invalidate(self, addr):
+        """
+        drop the decoded operations of the code page written at addr, if 
+        decoded code was hit, returns the pcs that were dropped
+        """
+        if addr & ~3 not in self._code and (addr + 3) & ~3 not in self._code:
+            return ()
+        pcs = self._pages.pop(addr >> 12, ())
+        for pc in pcs:
+            self._code.pop(pc, None)
+        return pcs
+    def _trap(self, cause, pc, tval = 0):
+        "take a trap at pc, returns the handler address"
+        tvec = self.csrs.get(MTVEC, 0) & ~3
+        if not tvec:
+            raise Trap(f"Unhandled trap {cause} at {pc:08x} (tval {tval:08x}).")
+        mstatus = self.csrs.get(MSTATUS, 0)
+        # previous privilege in MPP, MIE saved in MPIE and cleared
+        mstatus = (mstatus & ~0x1888) | (self.priv << 11) | ((mstatus & 0x8) << 4)
+        self.csrs.update({MSTATUS: mstatus, MEPC: pc, MCAUSE: cause, MTVAL: tval})
+        self.priv = 3
+        return tvec
+    def _system(self, name, pc):
+        "ecall, ebreak and mret, returns the next pc"
+        if name == 'mret':
+            mstatus = self.csrs.get(MSTATUS, 0)
+            self.priv = (mstatus >> 11) & 3
+            self.csrs[MSTATUS] = (mstatus & ~0x1808) | ((mstatus >> 4) & 0x8) | 0x80
+            return self.csrs.get(MEPC, 0)
+        if name == 'ecall':
+            return self._trap(ECALL_U + self.priv, pc)
+        return self._trap(BREAKPOINT, pc, pc)
+    def _csr(self, op, count):
+        "executes a csr instruction, returns the old value"
+        _kind, _rd, rs1, imm_form, num, cmd = op
+        num &= 0xfff
+        if num in (0xc00, 0xc01, 0xc02, 0xb00, 0xb02):
+            old = (self.instret + count) & _M # cycle, time and instret
+        elif num in (0xc80, 0xc81, 0xc82, 0xb80, 0xb82):
+            old = (self.instret + count) >> 32
+        elif num == MHARTID:
+            old = 0
+        else:
+            old = self.csrs.get(num, 0)
+        src = rs1 if imm_form else self.regs[rs1]
+        # csrrs/csrrc with x0 (or 0) do not write
+        if cmd == 1:
+            self.csrs[num] = src
+        elif cmd == 4 and rs1:
+            self.csrs[num] = old | src
+        elif cmd == 0 and rs1:
+            self.csrs[num] = old & ~src
+        return old
+    def _host(self, value):
+        "handles a write of value to tohost, returns True when the program exited"
+        if value & 1:
+            self.exit_code = value >> 1
+            return True
+        if value:
+            # value points at the syscall arguments, 4 64 bit words
+            out = self.mem.out
+            which, arg0, arg1, arg2 = [out(value + 8 * i, 4, False) for i in range(4)]
+            ret = -1
+            if which == SYS_write and arg0 in (1, 2):
+                self.stdout.write(bytes(self.mem.mem.read_block(arg1, arg2)).decode(errors = 'replace'))
+                ret = arg2
+            self.mem.clock(value, ret, 1)
+            self.mem.clock(self.tohost, 0, 1)
+            if self.fromhost is not None:
+                self.mem.clock(self.fromhost, 1, 1)
+        return False
+    def run(self, max_instructions = None):
+        """
+        executes until the program exits through tohost or max_instructions
+        were executed, returns the number of instructions executed
+        """
+        x = self.regs
+        pc = self.pc
+        code = self._code
+        pages = self._pages
+        out = self.mem.out
+        clock = self.mem.clock
+        tohost = self.tohost
+        limit = sys.maxsize if max_instructions is None else max_instructions
+        n = 0
+        start = time.perf_counter()
+        try:
+            while n < limit:
+                op = code.get(pc)
+                if op is None:
+                    op = self._decode(pc)
+                kind, rd, rs1, rs2, imm, fn = op
+                n += 1
+                if kind == _RI:
+                    x[rd] = fn(x[rs1], imm)
+                    pc += 4
+                elif kind == _RR:
+                    x[rd] = fn(x[rs1], x[rs2])
+                    pc += 4
+                elif kind == _BRANCH:
+                    if fn(x[rs1], x[rs2]):
+                        pc = (pc + imm) & _M
+                    else:
+                        pc += 4
+                elif kind == _LOAD:
+                    x[rd] = out((x[rs1] + imm) & _M, fn[0], fn[1]) & _M
+                    pc += 4
+                elif kind == _STORE:
+                    addr = (x[rs1] + imm) & _M
+                    clock(addr, x[rs2], 1, fn[0])
+                    pc += 4
+                    if addr >> 12 in pages:
+                        self._invalidate(addr)
+                    if addr == tohost and self._host(x[rs2]):
+                        break
+                elif kind == _JAL:
+                    x[rd] = pc + 4
+                    pc = (pc + imm) & _M
+                elif kind == _JALR:
+                    target = (x[rs1] + imm) & ~1 & _M
+                    x[rd] = pc + 4
+                    pc = target
+                elif kind == _LUI:
+                    x[rd] = imm
+                    pc += 4
+                elif kind == _AUIPC:
+                    x[rd] = (pc + imm) & _M
+                    pc += 4
+                elif kind == _CSR:
+                    x[rd] = self._csr(op, n)
+                    pc += 4
+                elif kind == _SYSTEM:
+                    pc = self._system(fn, pc)
+                elif kind == _NOP:
+                    pc += 4
+                else:
+                    pc = self._trap(ILLEGAL_INSTRUCTION, pc)
+        finally:
+            self.pc = pc
+            self.instret += n
+            self.seconds += time.perf_counter() - start
+        return n
+
+def start(cls, sys_mem, symbols, **kwargs):
+    "a simulator of class cls for a loaded program, starting at _start"
+    sim = cls(sys_mem, symbols.get('_start', sys_mem.begin_addr()), symbols, **kwargs)
+    # the stack is allocated at the end of memory
+    sim.regs[2] = (sys_mem.end_addr() - 16) & ~0xf
+    return sim
+
+def load(elffile, cls = ISS, **kwargs):
+    "a simulator of class cls for elffile loaded with load_elf (kwargs are passed on)"
+    return start(cls, *load_elf(elffile, quiet = True, **kwargs))
+
+def model(sys_mem, symbols, cycles, probe_addr, cls = ISS):
+    """
+    regress.py model, runs at most cycles instructions on a simulator of
+    class cls, program output is discarded
+    """
+    return start(cls, sys_mem, symbols, tohost = probe_addr,
+        stdout = io.StringIO()).run(cycles)
+
+def main(cls = ISS, description = __doc__):
+    parser = argparse.ArgumentParser(description = description.strip().split('\n')[0])
+    parser.add_argument("elffile")
+    parser.add_argument("-n", "--instructions", type = int, default = None,
+        help = "stop after this many instructions")
+    args = parser.parse_args()
+    sim = load(args.elffile, cls)
+    try:
+        sim.run(args.instructions)
+    except Trap as err:
+        print(err, file = sys.stderr)
+    status = f"exit code {sim.exit_code}" if sim.halted else f"stopped at pc {sim.pc:08x}"
+    print(f"{status}, {sim.instret} instructions in {sim.seconds:.3f} s, "
+        f"{sim.ips:,.0f} instructions/sec", file = sys.stderr)
+    sys.exit(sim.exit_code or 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+A basic block translating execution engine for the RV32I simulator.
+
+Straight-line code is discovered from memory up to the first branch or jump
+(is_branch, is_jump, is_jump_reg) and translated once into the source of a
+Python function, registers used by the block are kept in local variables.
+Blocks are cached by their start pc and dropped when a store hits an
+instruction of a translated page. CSR and SYSTEM instructions, traps and
+the last few instructions before an instruction limit are executed by the
+ISS interpreter this extends.
+
+Run as: python -m pydigital.riscv.translate [-n instructions] elffile
+"""
+import sys
+import time
+from functools import partial
+from .isa import decode
+from ..memory import _loads
+from . import iss
+from .iss import (ISS, _RR, _RI, _LUI, _AUIPC, _LOAD, _STORE, _BRANCH,
+    _JAL, _JALR, _NOP)
+
+# source templates by decoder.enums["ALU_fun"], S flips the sign bit so
+# unsigned comparisons order like signed ones
+_alu = {
+    1: "{a} ^ {b}",
+    2: "{a}",
+    3: "int({a} < {b})",
+    4: "{a} & {b}",
+    5: "({a} + {b}) & M",
+    6: "int(({a} ^ S) < ({b} ^ S))",
+    7: "((({a} ^ S) - S) >> {sh}) & M",
+    8: "({a} - {b}) & M",
+    9: "{a} >> {sh}",
+    10: "({a} << {sh}) & M",
+    11: "{a} | {b}",
+}
+# by decoder.enums["br_type"]
+_conditions = {
+    2: "{a} >= {b}",
+    3: "({a} ^ S) < ({b} ^ S)",
+    4: "{a} != {b}",
+    5: "({a} ^ S) >= ({b} ^ S)",
+    7: "{a} < {b}",
+    8: "{a} == {b}",
+}
+
+class Translator(ISS):
+    """
+    ISS that runs translated basic blocks, see ISS for the arguments.
+    max_block limits the instructions in one block.
+    """
+    def __init__(self, *args, max_block = 64, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_block = max_block
+        self._blocks = {} # start pc -> (function, instruction count, source lines)
+        # contiguous segments that loads can read directly
+        self._segs = [m for m in getattr(self.mem.mem, 'mems', [self.mem.mem])
+            if hasattr(m, 'data')]
+    def _invalidate(self, addr):
+        "drop the decoded operations and blocks of the code page written at addr"
+        pcs = super()._invalidate(addr)
+        for pc in pcs:
+            self._blocks.pop(pc, None)
+        return pcs
+    def source(self, pc):
+        """
+        source of the block starting at pc, its instruction count (0 when
+        the instruction at pc is not translated, it is interpreted) and a
+        dict of source line -> (pc, count) of the instruction on that line
+        """
+        body = []
+        owners = [] # (pc, count) of the instruction of each body line
+        used, written = set(), set()
+        def reg(r):
+            if r == 0:
+                return "0"
+            used.add(r)
+            return f"x{r}"
+        def dest(r):
+            written.add(r)
+            return reg(r)
+        def writeback():
+            return [f"    x[{r}] = x{r}" for r in sorted(written)]
+        start, count = pc, 0
+        end = None
+        x = self.regs
+        while count < self.max_block:
+            op = self._code.get(pc) or self._decode(pc)
+            kind, rd, rs1, rs2, imm, fn = op
+            if kind not in _translated:
+                break
+            c = decode(self.mem.out(pc, 4, signed = False)).control
+            count += 1
+            first = len(body)
+            if kind in (_RR, _RI):
+                if rd != 32:
+                    b = reg(rs2) if kind == _RR else hex(imm)
+                    sh = f"({b} & 31)" if kind == _RR else str(imm & 31)
+                    body.append(f"    {dest(rd)} = " + _alu[c.ALU_fun].format(a = reg(rs1), b = b, sh = sh))
+            elif kind == _LUI:
+                if rd != 32:
+                    body.append(f"    {dest(rd)} = {hex(imm)}")
+            elif kind == _AUIPC:
+                if rd != 32:
+                    body.append(f"    {dest(rd)} = {hex((pc + imm) & 0xffffffff)}")
+            elif kind == _LOAD:
+                size, signed = fn
+                body.append(f"    a = ({reg(rs1)} + {hex(imm)}) & M")
+                value = f"out(a, {size}, {signed}) & M"
+                seg = self._segment((x[rs1] + imm) & 0xffffffff)
+                if seg is not None:
+                    # read directly from the segment the first access hit
+                    k, lo, hi = seg
+                    unpack = f"L{size}{'s' if signed else 'u'}(d{k}, a - {hex(lo)})[0]"
+                    if signed:
+                        unpack += " & M"
+                    value = f"{unpack} if {hex(lo)} <= a <= {hex(hi - size)} else {value}"
+                body.append(f"    {dest(rd)} = {value}" if rd != 32 else f"    {value}")
+            elif kind == _STORE:
+                # stores to code or tohost leave the block, run() handles them
+                body.append(f"    a = ({reg(rs1)} + {hex(imm)}) & M")
+                body.append(f"    clock(a, {reg(rs2)}, 1, {fn[0]})")
+                body.append("    if a >> 12 in pages or a == tohost:")
+                body += ["    " + line for line in writeback()]
+                body.append(f"        return {hex(pc + 4)}, {count}, a, {reg(rs2)}")
+            elif kind == _BRANCH:
+                cond = _conditions[c.br_type].format(a = reg(rs1), b = reg(rs2))
+                body.append(f"    pc = {hex((pc + imm) & 0xffffffff)} if {cond} else {hex(pc + 4)}")
+                end = "pc"
+            elif kind == _JAL:
+                if rd != 32:
+                    body.append(f"    {dest(rd)} = {hex(pc + 4)}")
+                end = hex((pc + imm) & 0xffffffff)
+            elif kind == _JALR:
+                body.append(f"    pc = ({reg(rs1)} + {hex(imm)}) & {hex(0xfffffffe)}")
+                if rd != 32:
+                    body.append(f"    {dest(rd)} = {hex(pc + 4)}")
+                end = "pc"
+            owners += [(pc, count)] * (len(body) - first)
+            pc += 4
+            if end is not None:
+                break
+        if count == 0:
+            return None, 0, {}
+        # written registers are loaded too, so every exit can write them all back
+        head = [f"def block_{start:08x}(x, out, clock, pages, tohost):"]
+        head += [f"    x{r} = x[{r}]" for r in sorted(used | written)]
+        head.append("    try:")
+        # a faulting load or store keeps the registers written before it,
+        # run() finds the instruction from the line it was raised on
+        tail = writeback() + [f"    return {end or hex(pc)}, {count}, None, 0"]
+        fault = ["    except BaseException:"] + ["    " + line for line in writeback()] + ["        raise"]
+        lines = {len(head) + 1 + j: owner for j, owner in enumerate(owners)}
+        src = head + ["    " + line for line in body + tail] + fault
+        return "\n".join(src) + "\n", count, lines
+    def _fault(self, block, err):
+        "(pc, count) of the instruction of block that raised err"
+        tb = err.__traceback__
+        while tb is not None and tb.tb_frame.f_code is not block[0].__code__:
+            tb = tb.tb_next
+        return block[2][tb.tb_lineno]
+    def _segment(self, addr):
+        "(index, begin, end) of the directly readable segment holding addr, or None"
+        for k, m in enumerate(self._segs):
+            if m.begin_addr <= addr < m.end_addr:
+                return k, m.begin_addr, m.end_addr
+        return None
+    def _translate(self, pc):
+        "translates and caches the block at pc, None if it starts with an interpreted instruction"
+        src, count, lines = self.source(pc)
+        if src is None:
+            return None
+        namespace = {"M": 0xffffffff, "S": 0x80000000}
+        order = self.mem.mem.byteorder
+        for n in (1, 2, 4):
+            namespace[f"L{n}s"] = _loads[order, n, True]
+            namespace[f"L{n}u"] = _loads[order, n, False]
+        for k, m in enumerate(self._segs):
+            namespace[f"d{k}"] = m.data
+        exec(compile(src, f"<block {pc:08x}>", "exec"), namespace)
+        block = (namespace[f"block_{pc:08x}"], count, lines)
+        self._blocks[pc] = block
+        for page in {p >> 12 for p in range(pc, pc + 4 * count, 4)}:
+            self._pages.setdefault(page, []).append(pc)
+        return block
+    def run(self, max_instructions = None):
+        """
+        executes until the program exits through tohost or max_instructions
+        were executed, returns the number of instructions executed
+        """
+        limit = sys.maxsize if max_instructions is None else max_instructions
+        blocks = self._blocks
+        x = self.regs
+        out = self.mem.out
+        clock = self.mem.clock
+        pages = self._pages
+        tohost = self.tohost
+        n = 0
+        seconds = self.seconds
+        start = time.perf_counter()
+        pc = self.pc
+        try:
+            while n < limit:
+                block = blocks.get(pc)
+                if block is None:
+                    block = self._translate(pc)
+                if block is None or n + block[1] > limit:
+                    # interpreted, this updates instret
+                    self.pc = pc
+                    n += ISS.run(self, 1)
+                    pc = self.pc
+                    if self.halted:
+                        break
+                    continue
+                try:
+                    pc, k, addr, value = block[0](x, out, clock, pages, tohost)
+                except BaseException as err:
+                    # stop at the faulting instruction like the ISS does
+                    pc, k = self._fault(block, err)
+                    n += k
+                    self.instret += k
+                    raise
+                n += k
+                self.instret += k
+                if addr is not None:
+                    self._invalidate(addr)
+                    if addr == tohost and self._host(value):
+                        break
+        finally:
+            self.pc = pc
+            self.seconds = seconds + time.perf_counter() - start
+        return n
+
+_translated = (_RR, _RI, _LUI, _AUIPC, _LOAD, _STORE, _BRANCH, _JAL, _JALR, _NOP)
+
+# regress.py model, see iss.model
+model = partial(iss.model, cls = Translator)
+
+if __name__ == "__main__":
+    iss.main(Translator, __doc__)
@@ -6,7 +6,72 @@ The system class provides a clock to various modules.
 Alan Marchiori 2021
 """
 
-from .utils import verilog_fmt
+import sys
+import gzip
+import pickle
+from time import perf_counter
+from .utils import VerilogFormat
+
+class ModuleStats:
+    "profile of one module on one edge, times are in seconds"
+    def __init__(self, name, edge, n_inputs):
+        self.name = name
+        self.edge = edge
+        self.calls = 0
+        self.clock_time = 0.0
+        # sampling time of each input function
+        self.input_times = [0.0] * n_inputs
+    @property
+    def sample_time(self):
+        return sum(self.input_times)
+    @property
+    def total_time(self):
+        return self.sample_time + self.clock_time
+
+class SimStats:
+    """
+    Profile of a System, see System.profile(). modules holds a ModuleStats 
+    per module and edge, ticks counts the clock edges evaluated.
+    """
+    def __init__(self, report_every=None, output=None):
+        self.report_every = report_every
+        self.output = output
+        self.reset()
+    def reset(self):
+        "clear all counters and restart the wall clock"
+        self.ticks = 0
+        self.edge_time = 0.0 # time spent evaluating edges
+        self.start = perf_counter()
+        self.modules = {} # (edge, id(module)) -> ModuleStats
+    @property
+    def wall_time(self):
+        return perf_counter() - self.start
+    @property
+    def ticks_per_sec(self):
+        return self.ticks / max(self.wall_time, 1e-9)
+    def _record(self, edge, i, module):
+        rec = self.modules.get((edge, id(module)))
+        if rec is None:
+            name = f"{getattr(module, 'name', type(module).__name__)}[{i}]"
+            rec = ModuleStats(name, edge, len(module.inputs))
+            self.modules[edge, id(module)] = rec
+        return rec
+    def slowest_inputs(self, n=10):
+        "the n input functions with the most sampling time as (time, module name, edge, input index)"
+        times = [(t, rec.name, rec.edge, k) for rec in self.modules.values()
+            for k, t in enumerate(rec.input_times)]
+        return sorted(times, reverse=True)[:n]
+    def report(self, top=20):
+        "a table of the top modules by total time"
+        wall = max(self.wall_time, 1e-9)
+        s = [f"{self.ticks} ticks in {wall:.3f} s, {self.ticks / wall:,.0f} ticks/sec, "
+             f"{self.edge_time / wall:.0%} in modules",
+             f"{'module':24s} {'edge':4s} {'calls':>9s} {'sample s':>10s} {'clock s':>10s} {'us/call':>9s}"]
+        recs = sorted(self.modules.values(), key=lambda r: r.total_time, reverse=True)
+        for r in recs[:top]:
+            s.append(f"{r.name:24s} {r.edge:4s} {r.calls:9d} {r.sample_time:10.4f} "
+                f"{r.clock_time:10.4f} {1e6 * r.total_time / max(r.calls, 1):9.2f}")
+        return "\n".join(s) + "\n"
 
 class System():
     """
@@ -15,8 +80,18 @@ class System():
         reg clk = 0;
         always #1 clk = !clk;
     """
-    def __init__(self, posedge=[], negedge=[]):
-        "Pass in componets to be clocked on positive and negative edges"
+    def __init__(self, posedge=[], negedge=[], event_driven=False, output=None):
+        """
+        Pass in componets to be clocked on positive and negative edges
+        output is where monitor and display lines are written (see set_output)
+
+        With event_driven=True, modules that declare a sensitivity list (the
+        registers or functions their inputs read) are only sampled and 
+        clocked when one of those values changed since they were last 
+        clocked on that edge. Modules without a sensitivity list are always 
+        evaluated. Call wake() after changing a module outside of the clock 
+        (eg. reset) so it is evaluated again.
+        """
         self.time = 0
         self._val = False
         self._pos = posedge
@@ -25,15 +100,212 @@ class System():
         self._mon_vals = []
         self._disp_str = None
         self._disp_vals = []
+        self.output = output
+        self._tracers = []
+        self.event_driven = event_driven
+        self._events = None # event driven schedule, built on first use
+        self.stats = None # SimStats when profiling
+        self._tracked = [] # extra objects saved in checkpoints
+    def wake(self, module=None):
+        """
+        force module to be evaluated on the next event driven edges, with no 
+        module the schedule is rebuilt and every module is evaluated. Call it
+        after changing the module lists.
+        """
+        if module is None or self._events is None:
+            self._events = None
+            return
+        for modules, _always, _polled, pending in self._events[0]:
+            for i, x in enumerate(modules):
+                if x is module:
+                    pending.add(i)
+    def _schedule(self):
+        """
+        builds the event driven schedule from the module sensitivity lists.
+        Sensitivity entries with an out() method (registers) wake the module
+        when they are clocked to a new value, they must be clocked by this 
+        system. Functions are polled each edge, use them for anything else.
+        """
+        fanout = {}  # id(source) -> [(edge, module index)]
+        sources = {} # id(source) -> [source, last value]
+        edges = []
+        for edge, modules in enumerate((self._neg, self._pos)):
+            always, polled = [], []
+            for i, x in enumerate(modules):
+                sense = getattr(x, 'sensitivity', None)
+                if sense is None:
+                    always.append(i)
+                    continue
+                fns = []
+                for src in sense:
+                    if hasattr(src, 'out'):
+                        fanout.setdefault(id(src), []).append((edge, i))
+                        sources[id(src)] = [src, src.out()]
+                    else:
+                        fns.append(src)
+                if fns:
+                    polled.append((i, fns, [None]))
+            # everything is evaluated on the first edge
+            edges.append((modules, always, polled, set(range(len(modules)))))
+        self._events = (edges, fanout, sources)
+    def _evaluate_events(self, edge):
+        "sample and clock only the modules with an input that changed"
+        modules, active = self._active(edge)
+        vals = [[y() for y in modules[i].inputs] for i in active]
+        for i, v in zip(active, vals):
+            modules[i].clock(*v)
+        self._propagate(modules, active)
+    def _active(self, edge):
+        "the modules of edge and the sorted indices of those that must be evaluated"
+        if self._events is None:
+            self._schedule()
+        modules, always, polled, pending = self._events[0][edge]
+        active = pending.union(always)
+        pending.clear()
+        for i, fns, last in polled:
+            current = [f() for f in fns]
+            if current != last[0]:
+                last[0] = current
+                active.add(i)
+        return modules, sorted(active)
+    def _propagate(self, modules, active):
+        "wake the modules sensitive to registers that were clocked to a new value"
+        edges, fanout, sources = self._events
+        for i in active:
+            x = modules[i]
+            src = sources.get(id(x))
+            if src is not None:
+                new = x.out()
+                if new != src[1]:
+                    src[1] = new
+                    for e, k in fanout[id(x)]:
+                        edges[e][3].add(k)
+    def profile(self, enable=True, report_every=None, output=None):
+        """
+        Opt-in profiling, returns a SimStats that records the time each module
+        spends sampling its inputs and in clock(), per edge, and the overall 
+        ticks/sec. With report_every the report is written to output (default 
+        stderr) every that many ticks. The profiled evaluation replaces the 
+        normal one on this instance, so nothing is measured (or slowed down) 
+        when profiling is disabled. enable=False stops profiling and returns 
+        the last stats.
+        """
+        if not enable:
+            stats, self.stats = self.stats, None
+            self.__dict__.pop('_evaluate', None)
+            self.__dict__.pop('_evaluate_events', None)
+            return stats
+        self.stats = SimStats(report_every, output)
+        self._evaluate = self._evaluate_profiled
+        self._evaluate_events = self._evaluate_events_profiled
+        return self.stats
+    def _clock_profiled(self, edge, modules, active):
+        "sample and clock modules[i] for i in active, recording the times"
+        stats = self.stats
+        name = 'pos' if edge else 'neg'
+        recs = [stats._record(name, i, modules[i]) for i in active]
+        t_edge = perf_counter()
+        vals = []
+        for i, rec in zip(active, recs):
+            times = rec.input_times
+            v = []
+            for k, y in enumerate(modules[i].inputs):
+                t = perf_counter()
+                v.append(y())
+                times[k] += perf_counter() - t
+            vals.append(v)
+        for i, rec, v in zip(active, recs, vals):
+            t = perf_counter()
+            modules[i].clock(*v)
+            rec.clock_time += perf_counter() - t
+            rec.calls += 1
+        stats.edge_time += perf_counter() - t_edge
+        stats.ticks += 1
+        if stats.report_every and stats.ticks % stats.report_every == 0:
+            (stats.output or sys.stderr).write(stats.report())
+    def _evaluate_profiled(self, modules):
+        self._clock_profiled(modules is self._pos, modules, range(len(modules)))
+    def _evaluate_events_profiled(self, edge):
+        modules, active = self._active(edge)
+        self._clock_profiled(edge, modules, active)
+        self._propagate(modules, active)
+    def track(self, *objs):
+        """
+        include objects that are not clocked by this system (eg. a memory that
+        is only read through input functions) in checkpoints
+        """
+        self._tracked.extend(objs)
+    def _stateful(self):
+        "the modules and tracked objects with a checkpoint method, each once"
+        seen, objs = set(), []
+        for x in (*self._pos, *self._neg, *self._tracked):
+            if id(x) not in seen and hasattr(x, 'checkpoint'):
+                seen.add(id(x))
+                objs.append(x)
+        return objs
+    def checkpoint(self):
+        """
+        Snapshot of the simulation: the time, the clock level and the state
+        of every module (and tracked object) that has checkpoint() and 
+        restore(state) methods, such as registers and memories. Memory 
+        snapshots share the pages that were not written since the previous
+        checkpoint, so taking one while running only copies the dirty pages.
+        """
+        return {"time": self.time, "clock": self._val,
+            "state": [x.checkpoint() for x in self._stateful()]}
+    def restore(self, checkpoint):
+        "return to a checkpoint() of this system, eg. to rerun from the middle"
+        objs = self._stateful()
+        if len(objs) != len(checkpoint["state"]):
+            raise ValueError("Checkpoint does not match the modules of this system.")
+        for x, state in zip(objs, checkpoint["state"]):
+            x.restore(state)
+        self.time = checkpoint["time"]
+        self._val = checkpoint["clock"]
+        # modules changed outside of the clock and monitors print again
+        self.wake()
+        self._mon_last_vals = None
+    def save_checkpoint(self, filename, checkpoint=None):
+        "write a checkpoint (a new one by default) to a gzip compressed pickle file"
+        if checkpoint is None:
+            checkpoint = self.checkpoint()
+        with gzip.open(filename, 'wb', compresslevel=1) as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    def load_checkpoint(self, filename):
+        "restore a checkpoint written by save_checkpoint, returns it"
+        with gzip.open(filename, 'rb') as f:
+            checkpoint = pickle.load(f)
+        self.restore(checkpoint)
+        return checkpoint
+    def set_output(self, output, buffering=2**16):
+        """
+        Send monitor and display lines to output, a file-like object or a 
+        file name which is opened with a large buffer. None prints to stdout.
+        """
+        if isinstance(output, str):
+            output = open(output, 'w', buffering=buffering)
+        self.output = output
+    def flush(self):
+        "flush buffered monitor and display output"
+        (self.output or sys.stdout).flush()
+    def trace(self, tracer):
+        """
+        Attach a tracer such as a vcd.VCDWriter, its sample(time) method is 
+        called now and after every clock edge (also in headless runs).
+        """
+        self._tracers.append(tracer)
+        tracer.sample(self.time)
     def monitor(self, mon_str, *mon_vals):
         "Attach a monitor, mon_vals must be functions that return the current value"
         self._mon_str = mon_str
+        self._mon_fmt = VerilogFormat(mon_str)
         self._mon_vals = mon_vals
         self._mon_last_vals = None
         self.do_monitor()
     def display(self, mon_str, *mon_vals):
         "Attach a display, mon_vals must be functions that return the current value"
         self._disp_str = mon_str
+        self._disp_fmt = VerilogFormat(mon_str)
         self._disp_vals = mon_vals
         self.do_display()
     def do_display(self):
@@ -42,23 +314,25 @@ class System():
             clk = '-'
             if self._val:
                 clk = '+'
-            print (clk + verilog_fmt(self._disp_str, 
+            (self.output or sys.stdout).write(clk + self._disp_fmt(
                     *[x() for x in self._disp_vals], 
-                    timeval = self.time))        
+                    timeval = self.time) + '\n')
 
     def do_monitor(self):
         "evaluates the monitored expressions and prints if anything has changed"
+        if not self._mon_vals:
+            return
         # evaluate all monitored values and store
         current_vals = [x() for x in self._mon_vals]
 
         # only print if there is a monitor and something changed
-        if self._mon_str and self._mon_vals and current_vals != self._mon_last_vals:
+        if self._mon_str and current_vals != self._mon_last_vals:
             clk = '-'
             if self._val:
                 clk = '+'
-            print (clk + verilog_fmt(self._mon_str, 
+            (self.output or sys.stdout).write(clk + self._mon_fmt(
                     *current_vals, 
-                    timeval = self.time))
+                    timeval = self.time) + '\n')
         self._mon_last_vals = current_vals
 
     def __iter__(self):
@@ -70,32 +344,70 @@ class System():
         self._val ^= True # invert the clock level
         self.time += 1    # increment time 
 
-        def evaluate(modules):
-            # sample inputs
-            vals = []
-            for x in modules:
-                vals.append(list(y() for y in x.inputs))
-            # clock passing in input vals
-            for x,y in zip(modules, vals):
-                x.clock(*y)
-
         # execute the pos/negedge methods
-        if self._val:            
-            evaluate(self._pos)
+        if self.event_driven:
+            self._evaluate_events(self._val)
+        elif self._val:
+            self._evaluate(self._pos)
         else:
-            evaluate(self._neg)
+            self._evaluate(self._neg)
 
         # update monitor
         self.do_monitor()
         
         # execute displays
         self.do_display()
+
+        for t in self._tracers:
+            t.sample(self.time)
         return self._val  # return new clock level
 
-    def run(self, ticks=2):
+    def _evaluate(self, modules):
+        "sample all inputs then clock every module"
+        vals = []
+        for x in modules:
+            vals.append(list(y() for y in x.inputs))
+        # clock passing in input vals
+        for x,y in zip(modules, vals):
+            x.clock(*y)
+
+    def run(self, ticks=2, headless=False):
         """run the system for the given number of clock ticks (clock half-cycles), 
            like a #ticks; in verilog
            The default (2) runs one full clock period.
+           headless=True skips monitors and displays entirely and runs a tight 
+           loop over per-edge (clock, inputs) lists built once, otherwise it is 
+           the same as stepping with next().
         """       
-        for _i in range(ticks):
-            next(self)
\ No newline at end of file
+        tracers = self._tracers
+        if not headless:
+            for _i in range(ticks):
+                next(self)
+        elif self.stats is not None and not self.event_driven:
+            # profiled, the tight loop below would bypass the measurements
+            for _i in range(ticks):
+                self._val ^= True
+                self.time += 1
+                self._evaluate(self._pos if self._val else self._neg)
+                for t in tracers:
+                    t.sample(self.time)
+        elif self.event_driven:
+            for _i in range(ticks):
+                self._val ^= True
+                self.time += 1
+                self._evaluate_events(self._val)
+                for t in tracers:
+                    t.sample(self.time)
+        else:
+            # indexed by the new clock level
+            edges = ([(x.clock, tuple(x.inputs)) for x in self._neg],
+                     [(x.clock, tuple(x.inputs)) for x in self._pos])
+            for _i in range(ticks):
+                self._val ^= True
+                self.time += 1
+                edge = edges[self._val]
+                vals = [[y() for y in inputs] for _clock, inputs in edge]
+                for (clock, _inputs), v in zip(edge, vals):
+                    clock(*v)
+                for t in tracers:
+                    t.sample(self.time)
@@ -0,0 +1,80 @@
+"""
+Runs the rv32ui-p tests through the instruction set simulator and the
+translating engine, and checks that both engines execute identically.
+
+Run from the directory that holds the package: python -m pytest pydigital/test
+"""
+import io
+import os
+import glob
+import random
+import pytest
+from pydigital import regress
+from pydigital.memory import ELFMemory, MemorySegment
+from pydigital.riscv import iss, translate
+
+_programs = os.path.join(os.path.dirname(__file__), "..", "riscv", "programs")
+_rv32ui = sorted(glob.glob(os.path.join(_programs, "riscv-test", "rv32ui-p-*")))
+_benchmarks = sorted(glob.glob(os.path.join(_programs, "benchmarks", "*.riscv")))
+
+@pytest.mark.parametrize("model", [iss.model, translate.model], ids = ["iss", "translate"])
+@pytest.mark.parametrize("elffile", _rv32ui, ids = os.path.basename)
+def test_rv32ui(elffile, model):
+    r = regress.run_job(regress.Job(elffile, 10**5), model)
+    assert r.status == 'pass', r.message
+
+def state(sim):
+    "everything a run can change"
+    mems = sim.mem.mem.mems
+    return (sim.pc, list(sim.regs[:32]), sim.instret, sim.exit_code,
+        [bytes(m.read_block(m.begin_addr, len(m))) for m in mems])
+
+@pytest.mark.parametrize("elffile", _benchmarks[:3], ids = os.path.basename)
+def test_translate_matches_iss(elffile):
+    "both engines stop in the same state, also when resumed in random chunks"
+    rng = random.Random(5)
+    for _ in range(3):
+        stops = sorted(rng.randrange(1, 30000) for _ in range(4))
+        sims = [iss.load(elffile, cls) for cls in (iss.ISS, translate.Translator)]
+        for sim in sims:
+            sim.stdout = io.StringIO()
+            done = 0
+            for stop in stops:
+                done += sim.run(stop - done)
+        assert state(sims[0]) == state(sims[1])
+    sims = [iss.load(elffile, cls) for cls in (iss.ISS, translate.Translator)]
+    for sim in sims:
+        sim.stdout = io.StringIO()
+        sim.run()
+    assert sims[0].exit_code == 0
+    assert state(sims[0]) == state(sims[1])
+
+@pytest.mark.parametrize("word", [0x00002103, 0x00102023], ids = ["lw", "sw"])
+def test_fault(word):
+    "a faulting access inside a block stops at that instruction like the ISS"
+    # addi x1,x0,5; lw x2,0(x0) or sw x1,0(x0); addi x3,x0,1 with 0 unmapped
+    prog = [0x00500093, word, 0x00100193]
+    states = []
+    for cls in (iss.ISS, translate.Translator):
+        sys_mem = ELFMemory()
+        sys_mem += MemorySegment(0x1000, data = b"".join(w.to_bytes(4, 'little')
+            for w in prog) + bytes(16), byteorder = 'little')
+        sim = cls(sys_mem, 0x1000)
+        with pytest.raises(IndexError):
+            sim.run(10)
+        states.append((sim.pc, sim.regs[1], sim.regs[3], sim.instret))
+    assert states[0] == states[1] == (0x1004, 5, 0, 2)
+
+def test_self_modifying():
+    "a store over translated code drops the block"
+    # addi x1,x1,1; sw x2,8(x0) overwrites the next word with x2
+    # (addi x1,x1,16), which must run instead of the original addi x1,x1,2
+    prog = [0x00108093, 0x00202423, 0x00208093, 0x0000006f]
+    new = 0x01008093
+    for cls in (iss.ISS, translate.Translator):
+        seg = MemorySegment(0, data = b"".join(w.to_bytes(4, 'little') for w in prog),
+            byteorder = 'little')
+        sim = cls(seg, 0)
+        sim.regs[2] = new
+        sim.run(4)
+        assert sim.regs[1] == 17
@@ -0,0 +1,163 @@
+"""
+Checks of the memory segments: verilog memory files, block access across
+segments and checkpoints.
+
+Run from the directory that holds the package: python -m pytest pydigital/test
+"""
+import random
+import pytest
+from pydigital import memory
+from pydigital.memory import (Memory, MemorySegment, PagedMemory, ELFMemory,
+    readmemh, readmemb, writememh, writememb)
+from pydigital.register import Register, RegisterBank
+from pydigital.system import System
+
+def contents(mem):
+    "(begin address, bytes) of every segment"
+    return [(m.begin_addr, bytes(m.data)) for m in getattr(mem, 'mems', [mem])]
+
+def test_readmem_block_sizes(tmp_path):
+    "tokens and comments split at any block boundary read the same"
+    f = tmp_path / "c.hex"
+    f.write_text("@10 // c1 de ad\n0102_0304 a0b0c0d0 // t\t\n  deadbeef\t@20 ff 1\n// end")
+    expect = [(0x40, bytes.fromhex("01020304a0b0c0d0deadbeef")), (0x80, bytes.fromhex("000000ff00000001"))]
+    for block_size in range(1, 40):
+        m = memory._readmem(str(f), 16, 0, 4, 'big', block_size = block_size)
+        assert contents(m) == expect, block_size
+
+@pytest.mark.parametrize("write, read", [(writememh, readmemh), (writememb, readmemb)])
+def test_writemem_roundtrip(tmp_path, write, read):
+    "several @address sections are written and read back"
+    rng = random.Random(1)
+    for byteorder in ('little', 'big'):
+        sys_mem = ELFMemory()
+        for at, n in ((0x100, 64), (0x1000, 4096), (0x8000, 4)):
+            sys_mem += MemorySegment(at, data = rng.randbytes(n), byteorder = byteorder)
+        f = str(tmp_path / "mem.txt")
+        write(f, sys_mem)
+        assert contents(read(f, byteorder = byteorder)) == contents(sys_mem)
+        base = 16 if read is readmemh else 2
+        for block_size in (7, 100, 4096):
+            m = memory._readmem(f, base, 0, 4, byteorder, block_size = block_size)
+            assert contents(m) == contents(sys_mem)
+
+def test_readmem_single_line(tmp_path):
+    "to_hex output is one line"
+    seg = MemorySegment(0x40, data = random.Random(2).randbytes(4096))
+    f = tmp_path / "one.hex"
+    f.write_text(seg.to_hex())
+    assert contents(memory._readmem(str(f), 16, 0, 4, 'big', block_size = 64)) == contents(seg)
+
+def test_readmem_widths(tmp_path):
+    "short words are zero extended, wider ones are an error"
+    f = tmp_path / "w.hex"
+    f.write_text("123456 12345678 0\n")
+    assert bytes(readmemh(str(f)).data) == bytes.fromhex("001234561234567800000000")
+    f.write_text("123456 1234567890 00000000\n")
+    with pytest.raises(ValueError):
+        readmemh(str(f))
+
+def test_readmem_overwrite(tmp_path):
+    "later @address runs overwrite earlier words"
+    f = tmp_path / "o.hex"
+    f.write_text("@4 44444444\n@2 22222222 33333333\n@0 00000000 11111111\n@3 99999999\n")
+    assert contents(readmemh(str(f))) == [(0, bytes.fromhex("0000000011111111222222229999999944444444"))]
+    f.write_text("@1 33333333\n@0 11111111 22222222\n")
+    m = Memory(readmemh(str(f)))
+    assert [m.out(a, 4, False) for a in (4, 0, 4)] == [0x22222222, 0x11111111, 0x22222222]
+
+def test_overlapping_segments():
+    "overlapping segments resolve to the one added first, whatever was accessed before"
+    sys_mem = ELFMemory()
+    segs = [MemorySegment(0x10, data = b'A' * 16), MemorySegment(0, data = b'B' * 64),
+        MemorySegment(0x18, data = b'C' * 8), MemorySegment(0x80, data = b'D' * 8)]
+    for seg in segs:
+        sys_mem += seg
+    rng = random.Random(3)
+    for _ in range(1000):
+        addr = rng.randrange(0, 0x90)
+        assert sys_mem.find(addr) is next((m for m in segs if addr in m), None)
+    assert bytes(sys_mem.read_block(0x8, 16)) == b'B' * 8 + b'A' * 8
+
+@pytest.mark.parametrize("byteorder", ['little', 'big'])
+def test_store_across_segments(byteorder):
+    "a word store that crosses into the next segment (eg. .data into its bss tail)"
+    sys_mem = ELFMemory()
+    sys_mem += MemorySegment(0x1000, data = bytes(6), byteorder = byteorder)
+    sys_mem += MemorySegment(0x1006, data = bytes(10), byteorder = byteorder)
+    m = Memory(sys_mem)
+    m.clock(0x1004, 0xa1b2c3d4, 1, 4)
+    assert m.out(0x1004, 4, False) == 0xa1b2c3d4
+    sys_mem[0x1002] = bytes(range(1, 7))
+    assert bytes(sys_mem.read_block(0x1000, 10)) == bytes.fromhex("00000102030405060000")
+
+def test_item_segments():
+    "objects with only the item interface can be mapped (eg. device registers)"
+    class Device:
+        byteorder = 'little'
+        begin_addr, end_addr = 0x2000, 0x2010
+        def __init__(self):
+            self.regs = {}
+        def __contains__(self, addr):
+            return self.begin_addr <= addr < self.end_addr
+        def __getitem__(self, addr):
+            return self.regs.get(addr, 0)
+        def __setitem__(self, addr, val):
+            self.regs[addr] = int.from_bytes(val, self.byteorder)
+        def __len__(self):
+            return self.end_addr - self.begin_addr
+    sys_mem = ELFMemory()
+    sys_mem += MemorySegment(0x1000, 4, byteorder = 'little')
+    sys_mem += Device()
+    m = Memory(sys_mem)
+    m.clock(0x2008, 0xdeadbeef, 1, 4)
+    assert sys_mem.mems[1].regs[0x2008] == 0xdeadbeef
+    assert m.out(0x2008, 1, False) == 0xef
+
+def test_segment_copies_views():
+    "only mapped buffers are used in place"
+    a = MemorySegment(0, data = bytearray(16))
+    b = MemorySegment(0x100, data = a.read_block(0, 8))
+    b[0x100] = 0xffffffff
+    assert bytes(a.data) == bytes(16)
+    assert len(b) == 8
+
+@pytest.mark.parametrize("cls", [MemorySegment, PagedMemory])
+def test_checkpoint_restore(cls):
+    "restoring a checkpoint undoes the writes made after it"
+    seg = cls(0x1000, data = random.Random(4).randbytes(5 * 4096 + 100), byteorder = 'little')
+    m = Memory(seg)
+    before = bytes(seg.read_block(0x1000, len(seg)))
+    first = m.checkpoint()
+    for addr in (0x1000, 0x2ffe, 0x5000):
+        m.clock(addr, 0x12345678, 1, 4)
+    seg.write_block(0x3000, bytes(300))
+    after = bytes(seg.read_block(0x1000, len(seg)))
+    second = m.checkpoint()
+    m.clock(0x4000, 0xffffffff, 1, 4)
+    m.restore(first)
+    assert bytes(seg.read_block(0x1000, len(seg))) == before
+    m.restore(second)
+    assert bytes(seg.read_block(0x1000, len(seg))) == after
+
+def test_system_checkpoint(tmp_path):
+    "a system restored from a checkpoint reruns the same"
+    counter = Register()
+    counter.inputs = [lambda: (counter.out() + 1) & 0xff]
+    counter.reset(0)
+    bank = RegisterBank(4)
+    bank.reset(0)
+    bank.inputs = [lambda: (counter.out() & 3, counter.out())]
+    seg = MemorySegment(0, 256, byteorder = 'little')
+    mem = Memory(seg)
+    mem.inputs = [lambda: counter.out(), lambda: counter.out(), lambda: 1, lambda: 1]
+    s = System(posedge = [counter, bank, mem])
+    s.run(20, headless = True)
+    f = str(tmp_path / "cp.gz")
+    s.save_checkpoint(f)
+    s.run(30, headless = True)
+    state = (counter.out(), bank.out(), bytes(seg.data), s.time)
+    s.load_checkpoint(f)
+    assert s.time == 20
+    s.run(30, headless = True)
+    assert (counter.out(), bank.out(), bytes(seg.data), s.time) == state
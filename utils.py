@@ -5,45 +5,66 @@ Misc utilities for working on digital systems including sign extension of python
 """
 
 import re
-from functools import partial
+from functools import partial, lru_cache
+class _Undefined:
+    "formats as x's in place of an undefined (None) value, whatever the format spec"
+    def __init__(self, s):
+        self.s = s
+    def __format__(self, spec):
+        return self.s
+
+class VerilogFormat:
+    """
+    A verilog % style format string compiled once into a python format 
+    string, call it with the values to format (see verilog_fmt).
+
+    Example:
+    fmt = VerilogFormat("At time %3t, value = 0x%05x (%d)")
+    fmt(99, 99, timeval = 33)
+    At time  33, value = 0x00063 (99)
+    """
+    def __init__(self, fstr):
+        self.fstr = fstr
+        pos = 0
+        s = ""
+        self._undefined = [] # what to print for a None value of each argument
+        for part in re.finditer(r"(\%\d*[stxd])", fstr):
+            s += fstr[pos:part.start(0)].replace('{', '{{').replace('}', '}}')
+            pos = part.end(0)
+            fmt = part[0][1:]   # strip leading % from format
+            if part[0][-1] == 't':
+                fmt = fmt[:-1] + 'd' # replace trailing t with d for format
+                if fmt == 'd':  # check if no width specified because
+                    fmt = "20d" # verilog defaults to 20 digits for time.
+                s += "{0:" + fmt + "}" # time is always the first value
+            else:
+                widthstr = fmt[:-1]
+                self._undefined.append(_Undefined('x' * int(widthstr) if widthstr else 'x'))
+                s += "{" + str(len(self._undefined)) + ":" + fmt + "}"
+        s += fstr[pos:].replace('{', '{{').replace('}', '}}')
+        self._format = s.format
+    def __call__(self, *args, timeval = -1):
+        if None in args:
+            # if arg value is None, treat as Undefined (X)
+            args = [self._undefined[i] if v is None else v for i, v in enumerate(args)]
+        return self._format(timeval, *args)
+
+@lru_cache(maxsize=256)
+def _compiled_fmt(fstr):
+    return VerilogFormat(fstr)
+
 def verilog_fmt(fstr, *args, timeval = -1):
     """
     Verilog % style formating
     Supports %t for time and %d or %x for integers only!
     It does support width specifiers on all arg types.
+    Format strings are compiled once (see VerilogFormat) and cached.
 
     Example:
     verilog_fmt("At time %3t, value = 0x%05x (%d)", 99, 99, timeval = 33)
     At time  33, value = 0x00063 (99)
     """    
-    argidx = 0
-    pos = 0
-    s = ""
-    for part in re.finditer(r"(\%\d*[stxd])", fstr):
-        s += fstr[pos:part.start(0)]
-        pos = part.end(0)
-        fmt = part[0][1:]   # strip leading % from format
-        if part[0][-1] == 't':
-            val = timeval   # use special global time val
-            fmt = fmt[:-1] + 'd' # replace trailing t with d for format
-            if fmt == 'd':  # check if no width specified because
-                fmt = "20d" # verilog defaults to 20 digits for time.
-        else:
-            val = args[argidx]
-            argidx += 1
-            if val == None: # if arg value is None, treat as Undefined (X)
-                widthstr = fmt[:-1]
-                if widthstr == "":
-                    val = 'x'
-                else:
-                    try:
-                        val = 'x'*int(widthstr)
-                    except ValueError:
-                        val = 'x'
-                fmt = ""
-        s += format(val, fmt)
-    s += fstr[pos:]
-    return s
+    return _compiled_fmt(fstr)(*args, timeval = timeval)
 
 def sextend(val, c=32):
     "sign extend a c bit val to 32 bits as a python integer"
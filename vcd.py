@@ -0,0 +1,101 @@
+"""
+vcd.py
+======
+A streaming Value Change Dump (VCD) writer, open the output in a waveform
+viewer such as GTKWave.
+"""
+import gzip
+
+class VCDWriter:
+    """
+    Writes the changes of registered signals to a VCD file as the simulation
+    runs, only the last value of each signal is kept in memory.
+    Attach it to a system with System.trace(), for example:
+
+    with VCDWriter("run.vcd.gz") as vcd:
+        vcd.add("pc", pc_reg, 32)
+        vcd.add("mem_out", lambda: mem.out(addr.out()), 32)
+        system.trace(vcd)
+        system.run(1000000, headless=True)
+    """
+    def __init__(self, filename, timescale="1ns", scope="top",
+        compress=None, buffering=2**20):
+        """
+        open filename for writing, compress with gzip when compress is True
+        or by default when filename ends with .gz
+        """
+        if compress is None:
+            compress = filename.endswith('.gz')
+        if compress:
+            self.f = gzip.open(filename, 'wt')
+        else:
+            self.f = open(filename, 'w', buffering=buffering)
+        self.timescale = timescale
+        self.scope = scope
+        self._names = []
+        self._signals = []
+        self._formats = []
+        self._last = None # None until the header is written
+    def add(self, name, signal, width=32):
+        """
+        register a signal, a Register (anything with out()) or a function
+        returning the current value. None values are dumped as x.
+        """
+        if self._last is not None:
+            raise ValueError("Signals must be added before the first sample.")
+        code = self._code(len(self._signals))
+        self._names.append((name.replace(' ', '_'), width, code))
+        self._signals.append(signal.out if hasattr(signal, 'out') else signal)
+        if width == 1:
+            self._formats.append((code + '\n', 'x' + code + '\n', 1))
+        else:
+            self._formats.append((' ' + code + '\n', 'bx ' + code + '\n', (1 << width) - 1))
+    def _code(self, i):
+        "short identifier code for signal i, base 94 printable characters"
+        s = ''
+        while True:
+            s += chr(33 + i % 94)
+            i //= 94
+            if i == 0:
+                return s
+    def _line(self, i, val):
+        "the value change line of signal i"
+        suffix, undefined, mask = self._formats[i]
+        if val is None:
+            return undefined
+        if mask == 1:
+            return ('1' if val & 1 else '0') + suffix
+        return 'b' + format(val & mask, 'b') + suffix
+    def _header(self, time):
+        "write the declarations and the initial values"
+        s = [f"$timescale {self.timescale} $end\n", f"$scope module {self.scope} $end\n"]
+        for name, width, code in self._names:
+            s.append(f"$var wire {width} {code} {name} $end\n")
+        s.append("$upscope $end\n$enddefinitions $end\n")
+        self._last = [f() for f in self._signals]
+        s.append(f"#{time}\n$dumpvars\n")
+        s += [self._line(i, v) for i, v in enumerate(self._last)]
+        s.append("$end\n")
+        self.f.write(''.join(s))
+    def sample(self, time):
+        "write the signals that changed since the last sample at time"
+        if self._last is None:
+            self._header(time)
+            return
+        last = self._last
+        s = None
+        for i, f in enumerate(self._signals):
+            v = f()
+            if v != last[i]:
+                last[i] = v
+                if s is None:
+                    s = [f"#{time}\n"]
+                s.append(self._line(i, v))
+        if s is not None:
+            self.f.write(''.join(s))
+    def close(self):
+        self.f.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()